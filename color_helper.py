@@ -6,15 +6,20 @@ License: MIT
 """
 import sublime
 import sublime_plugin
-from ColorHelper.lib.rgba import RGBA
+from ColorHelper.lib.rgba import RGBA, convert_colors
 from ColorHelper.lib import csscolors
 import threading
-from time import time, sleep
-import re
+import bisect
+from itertools import accumulate, count
+from collections import deque
+from time import time
 import os
+import math
 import mdpopups
 import ColorHelper.color_helper_util as util
-from ColorHelper.color_helper_insert import InsertCalc, PickerInsertCalc
+from ColorHelper.color_helper_insert import InsertCalc, PickerInsertCalc, get_insert_window as get_color_window
+from ColorHelper.lib.engine import scanner, project
+from ColorHelper.lib.engine.index import FileIndex, common_prefix, scan_source
 from ColorHelper.multiconf import get as qualify_settings
 import traceback
 from html.parser import HTMLParser
@@ -27,6 +32,23 @@ PALETTE_SCALE_Y = 2
 BORDER_SIZE = 2
 PREVIEW_BORDER_SIZE = 1
 
+# Default thresholds of the degraded scan modes (can be overridden per rule in `color_scanning`)
+SCAN_LIMITS = {
+    "max_file_size": 2097152,
+    "max_line_length": 10000,
+    "max_previews": 500
+}
+# The viewport check interval is doubled, up to this factor, while the viewport doesn't change.
+PREVIEW_VIEWPORT_BACKOFF = 8
+
+SCAN_MODE_NORMAL = 'normal'
+SCAN_MODE_LARGE = 'large'
+SCAN_MODE_MINIFIED = 'minified'
+SCAN_MODE_STATUS = {
+    SCAN_MODE_LARGE: 'ColorHelper: large file mode',
+    SCAN_MODE_MINIFIED: 'ColorHelper: minified file mode'
+}
+
 reload_flag = False
 ch_last_updated = None
 ch_settings = None
@@ -38,35 +60,190 @@ if 'ch_thread' not in globals():
 if 'ch_file_thread' not in globals():
     ch_file_thread = None
 
+if 'ch_project_thread' not in globals():
+    ch_project_thread = None
+
 if 'ch_preview_thread' not in globals():
     ch_preview_thread = None
 
+if 'ch_preview_ids' not in globals():
+    ch_preview_ids = count(1)
+
+ch_file_index = {}
+ch_scan_regions = {}
+ch_preview_state = {}
+ch_scanners = {}
+ch_cursor_colors = {}
+ch_project_palettes = {}
+
 
 ###########################
 # Helper Classes/Functions
 ###########################
-def start_file_index(view):
-    """Kick off current file color index."""
+def percentile(samples, p):
+    """Get the nearest rank percentile of the samples."""
+
+    ordered = sorted(samples)
+    return ordered[max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)]
+
+
+def get_scan_regions(view, scope):
+    """Get the cached scannable regions of the view, rebuilding them if they are stale."""
+
+    scan_regions = ch_scan_regions.get(view.id())
+    if scan_regions is None or not scan_regions.is_current(view, scope):
+        scan_regions = ChScanRegions(view, scope)
+        ch_scan_regions[view.id()] = scan_regions
+    return scan_regions
+
+
+def get_view_scanner(view, rules=None):
+    """
+    Get the color scanner of the view's scan rules.
+
+    The scanner is resolved when the rules are set, and views with the same allowed colors share it.
+    Without rules, all colors are allowed.
+    """
+
+    if rules is None:
+        return scanner.get_scanner(util.ALL)
+    color_scanner = ch_scanners.get(view.id())
+    if color_scanner is None:
+        color_scanner = scanner.get_scanner(rules.get('allowed_colors', []))
+        ch_scanners[view.id()] = color_scanner
+    return color_scanner
+
+
+def get_color_at(view, point, rules=None):
+    """
+    Get the color at the point, or the incomplete color that ends at it.
+
+    Returns the window of the view that was searched and the `ColorAt` (relative to the window) or `None`.
+    The result is kept until the point, view, or rules change, so the auto popup,
+    the popups, and the insert commands of one selection change share a single lookup.
+    """
+
+    window = get_color_window(view, point)
+    color_scanner = get_view_scanner(view, rules)
+    key = (view.change_count(), point, window.begin(), window.end(), color_scanner)
+    cached = ch_cursor_colors.get(view.id())
+    if cached is None or cached[0] != key:
+        color = scanner.color_at(
+            view.substr(window), point - window.begin(), color_scanner.incomplete_re, touching=True
+        )
+        cached = (key, window, color)
+        ch_cursor_colors[view.id()] = cached
+    return cached[1:]
+
+
+def get_scan_mode(view, rules):
+    """
+    Get the scan mode of the view.
+
+    Views with more than `max_line_length` characters per visible line are minified,
+    and views larger than `max_file_size` are large.  Both are scanned in a degraded mode.
+    """
+
+    if rules is None:
+        return SCAN_MODE_NORMAL
+    visible = view.visible_region()
+    rows = view.rowcol(visible.end())[0] - view.rowcol(visible.begin())[0] + 1
+    if visible.size() > rows * rules.get('max_line_length', SCAN_LIMITS['max_line_length']):
+        return SCAN_MODE_MINIFIED
+    if view.size() > rules.get('max_file_size', SCAN_LIMITS['max_file_size']):
+        return SCAN_MODE_LARGE
+    return SCAN_MODE_NORMAL
+
+
+def update_scan_mode(view, rules):
+    """Get the scan mode of the view and show it in the status bar."""
+
+    mode = get_scan_mode(view, rules)
+    get_preview_state(view).set_mode(view, mode)
+    return mode
+
+
+def start_file_index(view, full=False, manual=False):
+    """
+    Kick off current file color index.
+
+    If the view already has an index, only the lines that changed
+    since the last index are rescanned unless a full index is requested.
+    In a degraded scan mode, the file is only indexed on request (`manual`).
+    """
     global ch_file_thread
     if view is not None and (ch_file_thread is None or not ch_file_thread.is_alive()):
         rules = util.get_rules(view)
+        mode = update_scan_mode(view, rules)
         if rules:
             scope = util.get_scope(view, rules, skip_sel_check=True)
-            if scope:
-                source = []
-                for r in view.find_by_selector(scope):
-                    source.append(view.substr(r))
+            if scope and not manual and mode != SCAN_MODE_NORMAL:
+                s = sublime.load_settings('color_helper.sublime-settings')
+                if s.get('show_index_status', True):
+                    sublime.status_message('File color indexer deferred in %s file mode...' % mode)
+            elif scope:
+                allowed_colors = rules.get('allowed_colors', [])
+                use_hex_argb = rules.get('use_hex_argb', False)
+                index = ch_file_index.get(view.id())
+                text = view.substr(sublime.Region(0, view.size()))
+                regions = [(r.begin(), r.end()) for r in get_scan_regions(view, scope).regions]
+                if full or index is None or index.rebuild or not index.is_compatible(allowed_colors, use_hex_argb):
+                    index = FileIndex(allowed_colors, use_hex_argb)
+                    ch_file_index[view.id()] = index
+                    index.snapshot(text, regions)
+                    rows = None
+                elif index.modified:
+                    rows = index.invalidate(text, regions)
+                else:
+                    # Nothing has changed since the last index.
+                    return
+                index.modified = False
+                source = index.get_source(text, rows)
                 util.debug('Regions to search:\n', source)
                 if len(source):
                     ch_file_thread = ChFileIndexThread(
-                        view, ' '.join(source),
-                        rules.get('allowed_colors', []),
-                        rules.get('use_hex_argb', False)
+                        view, index, source, rows,
+                        allowed_colors,
+                        use_hex_argb
                     )
                     ch_file_thread.start()
                     s = sublime.load_settings('color_helper.sublime-settings')
                     if s.get('show_index_status', True):
                         sublime.status_message('File color indexer started...')
+                else:
+                    index.update_rows(rows, {}, {})
+                    view.settings().set('color_helper.file_palette', list(index.palette))
+
+
+def get_project_palette(window, default=None):
+    """Get the formatted project palette of the window."""
+
+    colors = ch_project_palettes.get(window.id()) if window is not None else None
+    if colors is None:
+        return default
+    return util.format_palette_colors(colors)
+
+
+def start_project_index(window):
+    """Kick off the project color index of the window."""
+
+    global ch_project_thread
+    if window is not None and (ch_project_thread is None or not ch_project_thread.is_alive()):
+        s = sublime.load_settings('color_helper.sublime-settings')
+        folders = []
+        for folder in util.get_project_folders(window):
+            path = folder.get('path')
+            if path and not os.path.isabs(path) and window.project_file_name():
+                # Project folders can be relative to the project file.
+                folder = dict(folder, path=os.path.join(os.path.dirname(window.project_file_name()), path))
+            folders.append(folder)
+        ch_project_thread = ChProjectIndexThread(
+            window, folders, s.get('color_scanning', []),
+            s.get('project_index_workers', 0), s.get('project_index_python', '')
+        )
+        ch_project_thread.start()
+        if s.get('show_index_status', True):
+            sublime.status_message('Project color indexer started...')
 
 
 def preview_is_on_left():
@@ -146,9 +323,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
         return
         if ch_thread.ignore_all:
             return
-        now = time()
-        ch_thread.modified = True
-        ch_thread.time = now
+        ch_thread.schedule()
 
     def prompt_palette_name(self, palette_type, color):
         """Prompt user for new palette name."""
@@ -335,64 +510,17 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
                 allowed_colors = rules.get('allowed_colors', []) if rules else util.ALL
                 compress_hex = rules.get('compress_hex_output', False) if rules else False
                 calc = InsertCalc(self.view, point, target_color, convert, allowed_colors, use_hex_argb)
-                calc.calc()
+                calc.calc(get_color_at(self.view, point, rules)[1])
                 if alpha:
                     calc.alpha_hex = target_color[-2:]
                     calc.alpha = util.fmt_float(float(int(calc.alpha_hex, 16)) / 255.0, dlevel)
-                if calc.web_color and not calc.alpha:
-                    value = calc.web_color
-                elif calc.convert_rgb:
-                    value = "%d, %d, %d" % (
-                        int(calc.color[1:3], 16),
-                        int(calc.color[3:5], 16),
-                        int(calc.color[5:7], 16)
-                    )
-                    if calc.alpha:
-                        value += ', %s' % calc.alpha
-                    value = ("rgba(%s)" if calc.alpha else "rgb(%s)") % value
-                elif calc.convert_gray:
-                    value = "%d" % int(calc.color[1:3], 16)
-                    if calc.alpha:
-                        value += ', %s' % calc.alpha
-                    value = "gray(%s)" % value
-                elif calc.convert_hsl:
-                    hsl = RGBA(calc.color)
-                    h, l, s = hsl.tohls()
-                    value = "%s, %s%%, %s%%" % (
-                        util.fmt_float(h * 360.0),
-                        util.fmt_float(s * 100.0),
-                        util.fmt_float(l * 100.0)
-                    )
-                    if calc.alpha:
-                        value += ', %s' % calc.alpha
-                    value = ("hsla(%s)" if calc.alpha else "hsl(%s)") % value
-                elif calc.convert_hwb:
-                    hwb = RGBA(calc.color)
-                    h, w, b = hwb.tohwb()
-                    value = "%s, %s%%, %s%%" % (
-                        util.fmt_float(h * 360.0),
-                        util.fmt_float(w * 100.0),
-                        util.fmt_float(b * 100.0)
-                    )
-                    if calc.alpha:
-                        value += ', %s' % calc.alpha
-                    value = "hwb(%s)" % value
-                else:
-                    use_upper = ch_settings.get("upper_case_hex", False)
-                    color = calc.color
-                    if calc.alpha_hex:
-                        if convert == 'ahex':
-                            color = '#' + calc.alpha_hex + calc.color[1:]
-                        else:
-                            color = calc.color + calc.alpha_hex
-                    if compress_hex:
-                        color = util.compress_hex(color)
-                    value = color.upper() if use_upper else color.lower()
+                use_upper = ch_settings.get("upper_case_hex", False)
+                value = calc.get_value(convert, compress_hex, use_upper)
             else:
                 rules = util.get_rules(self.view)
                 allowed_colors = rules.get('allowed_colors', []) if rules else util.ALL
                 calc = PickerInsertCalc(self.view, point, allowed_colors)
-                calc.calc()
+                calc.calc(get_color_at(self.view, point, rules)[1])
                 value = target_color
             self.view.sel().subtract(sels[0])
             self.view.sel().add(calc.region)
@@ -414,7 +542,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
 
         colors.append(
             '[%s](%s)' % (
-                mdpopups.color_box(
+                util.color_box(
                     color_list, '#cccccc', '#333333',
                     height=self.color_h, width=self.palette_w * PALETTE_SCALE_X,
                     border_size=BORDER_SIZE, check_size=self.check_size(self.color_h)
@@ -431,13 +559,9 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
         count = 0
 
         check_size = self.check_size(self.color_h)
-        for f in color_list:
-            parts = f.split('@')
-            if len(parts) > 1:
-                color = parts[0]
-            else:
-                color = f
-            no_alpha_color = color[:-2] if len(f) > 7 else color
+        columns = convert_colors([f.split('@')[0] for f in color_list], columns=('hex', 'alpha'))
+        for f, no_alpha_color, alpha in zip(color_list, columns.hex, columns.alpha):
+            color = '%s%02x' % (no_alpha_color, alpha)
             if count != 0 and (count % 8 == 0):
                 colors.append('\n\n')
             elif count != 0:
@@ -448,7 +572,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
             if delete:
                 colors.append(
                     '[%s](__delete_color__:%s:%s:%s)' % (
-                        mdpopups.color_box(
+                        util.color_box(
                             [no_alpha_color, color], '#cccccc', '#333333',
                             height=self.color_h, width=self.color_w, border_size=BORDER_SIZE,
                             check_size=check_size
@@ -459,7 +583,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
             else:
                 colors.append(
                     '[%s](__insert__:%s:%s:%s)' % (
-                        mdpopups.color_box(
+                        util.color_box(
                             [no_alpha_color, color], '#cccccc', '#333333',
                             height=self.color_h, width=self.color_w, border_size=BORDER_SIZE,
                             check_size=check_size
@@ -485,13 +609,10 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
         else:
             alpha_hex = ''
 
-        try:
-            web_color = csscolors.hex2name(rgba.get_rgb())
-        except Exception:
-            web_color = None
-
-        h1, l, s = rgba.tohls()
-        h2, w, b = rgba.tohwb()
+        columns = convert_colors([rgba.get_rgba()], csscolors.hex2name_map, columns=('name', 'hsl', 'hwb'))
+        web_color = columns.name[0]
+        h1, s, l = columns.hsl[0]
+        h2, w, b = columns.hwb[0]
 
         use_upper = ch_settings.get("upper_case_hex", False)
 
@@ -522,11 +643,12 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
         show_project_palettes = s.get('enable_project_user_palettes', True)
         show_favorite_palette = s.get('enable_favorite_palette', True)
         show_current_palette = s.get('enable_current_file_palette', True)
+        show_project_palette = s.get('enable_project_palette', True)
         show_conversions = s.get('enable_color_conversions', True)
         show_picker = s.get('enable_color_picker', True)
         palettes_enabled = (
             show_global_palettes or show_project_palettes or
-            show_favorite_palette or show_current_palette
+            show_favorite_palette or show_current_palette or show_project_palette
         )
         click_color_box_to_pick = s.get('click_color_box_to_pick', 'none')
 
@@ -547,7 +669,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
 
         no_alpha_color = color[:-2] if len(color) > 7 else color
         template_vars['color_preview'] = (
-            mdpopups.color_box(
+            util.color_box(
                 [no_alpha_color, color], '#cccccc', '#333333',
                 height=self.color_h * PREVIEW_SCALE_Y, width=self.palette_w * PALETTE_SCALE_X,
                 border_size=BORDER_SIZE, check_size=self.check_size(self.color_h)
@@ -582,7 +704,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
             use_hex_argb = rules.get("use_hex_argb", False) if rules else None
             allowed_colors = rules.get('allowed_colors', []) if rules else util.ALL
             calc = InsertCalc(self.view, point, parts[0], 'rgba', allowed_colors, bool(use_hex_argb))
-            found = calc.calc()
+            found = calc.calc(get_color_at(self.view, point, rules)[1])
 
             rules = util.get_rules(self.view)
             allowed_colors = rules.get('allowed_colors', []) if rules else util.ALL
@@ -592,13 +714,10 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
             rgba = RGBA(parts[0])
             alpha = util.fmt_float(float(rgba.a) / 255.0, dlevel)
 
-            try:
-                web_color = csscolors.hex2name(rgba.get_rgb())
-            except Exception:
-                web_color = None
-
-            h1, l, s = rgba.tohls()
-            h2, w, b = rgba.tohwb()
+            columns = convert_colors([rgba.get_rgba()], csscolors.hex2name_map, columns=('name', 'hsl', 'hwb'))
+            web_color = columns.name[0]
+            h1, s, l = columns.hsl[0]
+            h2, w, b = columns.hwb[0]
 
             use_upper = ch_settings.get("upper_case_hex", False)
 
@@ -672,6 +791,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
         show_project_palettes = s.get('enable_project_user_palettes', True)
         show_favorite_palette = s.get('enable_favorite_palette', True)
         show_current_palette = s.get('enable_current_file_palette', True)
+        show_project_palette = s.get('enable_project_palette', True)
         s = sublime.load_settings('color_helper.sublime-settings')
         show_picker = s.get('enable_color_picker', True) and self.no_info
         palettes = util.get_palettes()
@@ -688,6 +808,7 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
             "show_new_ui": bool(color),
             "show_favorite_palette": show_favorite_palette,
             "show_current_palette": show_current_palette,
+            "show_project_palette": show_project_palette,
             "show_global_palettes": show_global_palettes and len(palettes),
             "show_project_palettes": show_project_palettes and len(project_palettes)
         }
@@ -701,13 +822,21 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
                 )
 
         if show_current_palette:
-            current_colors = self.view.settings().get('color_helper.file_palette', [])
+            current_colors = util.get_file_palette(self.view, [])
             if not delete and not color and len(current_colors):
                 show_div = True
                 template_vars['current_palette'] = (
                     self.format_palettes(current_colors, "Current Colors", '__special__', delete=delete, color=color)
                 )
 
+        if show_project_palette:
+            project_colors = get_project_palette(self.view.window(), [])
+            if not delete and not color and len(project_colors):
+                show_div = True
+                template_vars['project_palette'] = (
+                    self.format_palettes(project_colors, "Project Colors", '__special__', delete=delete, color=color)
+                )
+
         if show_global_palettes and len(palettes):
             if show_div:
                 template_vars['show_separator'] = True
@@ -775,7 +904,13 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
                 current = True
                 target = {
                     "name": palette_name,
-                    "colors": self.view.settings().get('color_helper.file_palette', [])
+                    "colors": util.get_file_palette(self.view, [])
+                }
+            elif palette_name == "Project Colors":
+                current = True
+                target = {
+                    "name": palette_name,
+                    "colors": get_project_palette(self.view.window(), [])
                 }
             elif palette_name == "Favorites":
                 target = util.get_favs()
@@ -831,48 +966,11 @@ class ColorHelperCommand(sublime_plugin.TextCommand):
         sels = self.view.sel()
         if (len(sels) == 1 and sels[0].size() == 0):
             point = sels[0].begin()
-            visible = self.view.visible_region()
-            start = point - 50
-            end = point + 50
-            if start < visible.begin():
-                start = visible.begin()
-            if end > visible.end():
-                end = visible.end()
-            bfr = self.view.substr(sublime.Region(start, end))
-            ref = point - start
             rules = util.get_rules(self.view)
             use_hex_argb = rules.get("use_hex_argb", False) if rules else False
-            allowed_colors = rules.get('allowed_colors', []) if rules else util.ALL
-            for m in util.COLOR_RE.finditer(bfr):
-                if ref >= m.start(0) and ref < m.end(0):
-                    if m.group('hex_compressed') and 'hex_compressed' not in allowed_colors:
-                        continue
-                    elif m.group('hexa_compressed') and 'hexa_compressed' not in allowed_colors:
-                        continue
-                    elif m.group('hex') and 'hex' not in allowed_colors:
-                        continue
-                    elif m.group('hexa') and 'hexa' not in allowed_colors:
-                        continue
-                    elif m.group('rgb') and 'rgb' not in allowed_colors:
-                        continue
-                    elif m.group('rgba') and 'rgba' not in allowed_colors:
-                        continue
-                    elif m.group('gray') and 'gray' not in allowed_colors:
-                        continue
-                    elif m.group('graya') and 'graya' not in allowed_colors:
-                        continue
-                    elif m.group('hsl') and 'hsl' not in allowed_colors:
-                        continue
-                    elif m.group('hsla') and 'hsla' not in allowed_colors:
-                        continue
-                    elif m.group('hwb') and 'hwb' not in allowed_colors:
-                        continue
-                    elif m.group('hwba') and 'hwba' not in allowed_colors:
-                        continue
-                    elif m.group('webcolors') and 'webcolors' not in allowed_colors:
-                        continue
-                    color, alpha, alpha_dec = util.translate_color(m, bool(use_hex_argb))
-                    break
+            found = get_color_at(self.view, point, rules)[1]
+            if found is not None and found.complete and not found.at_end:
+                color, alpha, alpha_dec = util.translate_color(found.match, bool(use_hex_argb))
         return color, alpha, alpha_dec
 
     def show_color_info(self, update=False):
@@ -1009,7 +1107,7 @@ class ColorHelperFileIndexCommand(sublime_plugin.TextCommand):
         rules = util.get_rules(self.view)
         if rules and util.get_scope(self.view, rules, skip_sel_check=True):
             if ch_file_thread is None or not ch_file_thread.is_alive():
-                start_file_index(self.view)
+                start_file_index(self.view, full=True, manual=True)
             else:
                 sublime.error_message("File indexer is already running!")
         else:
@@ -1022,35 +1120,344 @@ class ColorHelperFileIndexCommand(sublime_plugin.TextCommand):
         return s.get('enable_current_file_palette', True)
 
 
+class ColorHelperProjectIndexCommand(sublime_plugin.WindowCommand):
+    """Color Helper project index command."""
+
+    def run(self, cancel=False):
+        """Run the command."""
+
+        if cancel:
+            if ch_project_thread is not None and ch_project_thread.is_alive():
+                ch_project_thread.cancel()
+        elif not util.get_project_folders(self.window):
+            sublime.error_message('There are no project folders to index!')
+        elif ch_project_thread is None or not ch_project_thread.is_alive():
+            start_project_index(self.window)
+        else:
+            sublime.error_message("Project indexer is already running!")
+
+    def is_enabled(self, cancel=False):
+        """Check if command is enabled."""
+
+        if cancel:
+            return ch_project_thread is not None and ch_project_thread.is_alive()
+        s = sublime.load_settings('color_helper.sublime-settings')
+        return s.get('enable_project_palette', True)
+
+
 ###########################
 # Threading
 ###########################
+class ChPreviewRecord(object):
+    """
+    Record of a color preview.
+
+    Records are built without a phantom, so prefetched previews can be cached as is.
+    The phantom is added when the preview is shown.
+    """
+
+    __slots__ = ('point', 'content', 'color', 'length', 'color_type', 'scope_hash', 'preview_id', 'phantom')
+
+    def __init__(self, point, content, color, length, color_type, scope_hash, preview_id, phantom=None):
+        """Setup."""
+
+        self.point = point
+        self.content = content
+        self.color = color
+        self.length = length
+        self.color_type = color_type
+        self.scope_hash = scope_hash
+        self.preview_id = preview_id
+        self.phantom = phantom
+
+
+class ChPhantomSet(sublime.PhantomSet):
+    """
+    Phantom set that is diffed by identity.
+
+    `PhantomSet.update` matches phantoms by equality, which requires querying the
+    region of every phantom and a quadratic search.  Previews hold on to their
+    phantom objects, so a phantom that is still wanted is simply kept as is.
+    """
+
+    def update(self, new_phantoms):
+        """Add the new phantoms and erase the ones that are no longer wanted."""
+
+        current = set(id(p) for p in self.phantoms)
+        wanted = set(id(p) for p in new_phantoms)
+        for p in self.phantoms:
+            if id(p) not in wanted:
+                self.view.erase_phantom_by_id(p.id)
+        for p in new_phantoms:
+            if id(p) not in current:
+                p.id = self.view.add_phantom(self.key, p.region, p.content, p.layout, p.on_navigate)
+        self.phantoms = new_phantoms
+
+
+class ChPreviewState(object):
+    """
+    Preview state of a view.
+
+    Previews are keyed by the point of their phantom and indexed by their preview ID
+    (the href of their color box) for click lookups.  The state lives in
+    memory instead of the view settings, so it is never serialized.
+    The phantoms of the previews are applied to the view with a single
+    `PhantomSet` update which keeps the phantoms that haven't changed.
+    A snapshot of the text from the first to the last preview (or the viewport)
+    is kept so the first line touched by an edit can be found later.  The start of
+    the snapshot is anchored with a hidden region that Sublime Text moves with the text,
+    so edits above the snapshot are found without reading the text before it.
+
+    Previews built around the viewport are cached by point for the change count of the view,
+    so scrolling into the prefetched area doesn't need to search or render.
+
+    The viewport (and column window) of the last search is kept so only the newly exposed part
+    of the view is searched next time.
+
+    In a degraded scan mode, no snapshot is kept (`None`) and every edit revalidates all previews.
+    """
+
+    __slots__ = (
+        'previews', 'ids', 'box_height', 'color_scheme', 'phantom_set', 'borders', 'snapshot', 'snapshot_begin',
+        'snapshot_count', 'dirty', 'prefetch', 'prefetch_count', 'prefetch_region', 'prefetch_points', 'mode',
+        'previous_region', 'previous_column'
+    )
+
+    def __init__(self, view):
+        """Setup."""
+
+        self.previews = {}
+        self.ids = {}
+        self.box_height = 0
+        self.color_scheme = ''
+        self.phantom_set = ChPhantomSet(view, 'color_helper')
+        self.borders = {}
+        self.snapshot = ''
+        self.snapshot_begin = 0
+        self.snapshot_count = -1
+        self.dirty = None
+        self.clear_prefetch()
+        self.mode = None
+        self.previous_region = sublime.Region(0)
+        self.previous_column = None
+
+    def get_border(self, view, scope):
+        """Get the preview border color for the scope (derived from the scope's background)."""
+
+        border = self.borders.get(scope)
+        if border is None:
+            rgba = RGBA(mdpopups.scope2style(view, scope)['background'])
+            rgba.brightness(1.1 if rgba.get_luminance() <= 127 else .9)
+            border = rgba.get_rgb()
+            self.borders[scope] = border
+        return border
+
+    def update_phantoms(self):
+        """Apply the phantoms of the current previews to the view."""
+
+        self.phantom_set.update([record.phantom for record in self.previews.values()])
+
+    def clear_prefetch(self, change_count=-1):
+        """Clear the prefetched previews and key the cache to the change count."""
+
+        self.prefetch = {}
+        self.prefetch_count = change_count
+        self.prefetch_region = None
+        self.prefetch_points = []
+
+    def cache_preview(self, change_count, record):
+        """Cache a built preview (the cache is cleared first if the view has changed)."""
+
+        if self.prefetch_count != change_count:
+            self.clear_prefetch(change_count)
+        self.prefetch[record.point] = record
+
+    def get_prefetched(self, view, region):
+        """
+        Get the cached previews in the region.
+
+        Returns `None` if the cache doesn't cover the whole region for the current change count.
+        """
+
+        covered = self.prefetch_region
+        if covered is None or self.prefetch_count != view.change_count() or not covered.contains(region):
+            return None
+        points = self.prefetch_points
+        lo = bisect.bisect_left(points, region.begin())
+        hi = bisect.bisect_right(points, region.end())
+        return [self.prefetch[pt] for pt in points[lo:hi]]
+
+    def take_snapshot(self, view, visible_region, position_on_left):
+        """Remember the lines from the first preview or the start of the viewport to the last preview or its end."""
+
+        begin = visible_region.begin()
+        end = visible_region.end()
+        for pt, record in self.previews.items():
+            color_start = pt if position_on_left else pt - record.length
+            color_end = pt + record.length if position_on_left else pt
+            if color_start < begin:
+                begin = color_start
+            if color_end > end:
+                end = color_end
+        size = view.size()
+        begin = view.line(min(max(begin, 0), size)).begin()
+        end = view.line(min(end, size)).end()
+        self.snapshot = view.substr(sublime.Region(begin, end))
+        self.snapshot_begin = begin
+        self.snapshot_count = view.change_count()
+        view.add_regions('color_helper_snapshot', [sublime.Region(begin, begin)], '', '', sublime.HIDDEN)
+        self.dirty = None
+
+    def get_dirty_begin(self, view):
+        """
+        Get the start of the first line that changed since the snapshot.
+
+        Scopes only depend on the text before them (and the rest of their line),
+        so everything ending before the line is untouched by the edit.
+        If the anchor at the start of the snapshot moved, or a selection (where edits are made)
+        is before it, the text before the snapshot changed and everything may have moved, so `0` is returned.
+        Returns `None` if the text of the snapshot didn't change.
+        """
+
+        if self.snapshot is None:
+            return 0
+        if view.change_count() == self.snapshot_count:
+            return None
+        begin = self.snapshot_begin
+        anchor = view.get_regions('color_helper_snapshot')
+        if not anchor or anchor[0].begin() != begin or any(sel.begin() < begin for sel in view.sel()):
+            return 0
+        size = len(self.snapshot)
+        text = view.substr(sublime.Region(begin, min(begin + size, view.size())))
+        prefix = common_prefix(self.snapshot, text)
+        if prefix == size:
+            return None
+        return view.line(begin + prefix).begin()
+
+    def set_mode(self, view, mode):
+        """Set the scan mode and show it in the status bar."""
+
+        if mode != self.mode:
+            self.mode = mode
+            if mode in SCAN_MODE_STATUS:
+                view.set_status('color_helper_mode', SCAN_MODE_STATUS[mode])
+            else:
+                view.erase_status('color_helper_mode')
+
+    def reset(self, view):
+        """Forget all previews (the phantoms must be erased by the caller)."""
+
+        self.previews = {}
+        self.ids = {}
+        self.phantom_set = ChPhantomSet(view, 'color_helper')
+        self.borders = {}
+        view.erase_regions('color_helper_snapshot')
+        self.snapshot = ''
+        self.snapshot_begin = 0
+        self.snapshot_count = -1
+        self.dirty = None
+        self.clear_prefetch()
+        self.previous_region = sublime.Region(0)
+
+
+def get_preview_state(view):
+    """Get the preview state of the view."""
+
+    state = ch_preview_state.get(view.id())
+    if state is None:
+        state = ChPreviewState(view)
+        ch_preview_state[view.id()] = state
+    return state
+
+
+def clear_preview_state(view):
+    """Forget the previews of the view."""
+
+    ch_preview_state.pop(view.id(), None)
+
+
+class ChPreviewJob(object):
+    """
+    Colors found by a preview search that still need a preview.
+
+    Matches are sorted so the one nearest to the caret (or the viewport center) is rendered first.
+    The color pattern of the view's rules is kept with the job, so slices search with the rules it was started with.
+    A prefetch job (with an `area`) only caches the previews it builds for the area,
+    and searches its `source` regions in its first slice.  A job with a `limit` stops
+    when the view has that many previews.
+    """
+
+    __slots__ = (
+        'view_id', 'change_count', 'visible_region', 'matches', 'color_re', 'box_height', 'check_size',
+        'use_hex_argb', 'position_on_left', 'start', 'rendered', 'area', 'source', 'limit'
+    )
+
+    def __init__(
+        self, view, visible_region, matches, color_re, box_height, check_size, use_hex_argb, position_on_left, start,
+        area=None
+    ):
+        """Setup."""
+
+        self.view_id = view.id()
+        self.change_count = view.change_count()
+        self.visible_region = visible_region
+        self.matches = matches
+        self.color_re = color_re
+        self.box_height = box_height
+        self.check_size = check_size
+        self.use_hex_argb = use_hex_argb
+        self.position_on_left = position_on_left
+        self.start = start
+        self.rendered = False
+        self.area = area
+        self.source = None
+        self.limit = None
+
+    def is_current(self, view, visible_region):
+        """
+        Check if the job still applies to the view.
+
+        Our own phantoms can change the end of the viewport, so only the start is compared.
+        """
+
+        return (
+            view.id() == self.view_id and view.change_count() == self.change_count and
+            visible_region.begin() == self.visible_region.begin()
+        )
+
+
 class ChPreview(object):
-    """Color Helper preview with phantoms."""
+    """
+    Color Helper preview with phantoms.
+
+    Previews are rendered in slices of `preview_slice_budget` milliseconds, nearest to the caret first.
+    Unfinished work is kept as a job which is resumed on the next pass, or dropped if the view changed.
+    """
 
     def __init__(self):
         """Setup."""
 
-        self.previous_region = sublime.Region(0, 0)
+        self.job = None
+        self.first_preview_times = deque(maxlen=200)
 
     def on_navigate(self, href, view):
         """Handle color box click."""
 
         view.sel().clear()
-        previews = view.settings().get('color_helper.preview_meta', {})
-        for k, v in previews.items():
-            if href == v[5]:
-                phantoms = view.query_phantom(v[4])
-                if phantoms:
-                    pt = phantoms[0].begin()
-                    view.sel().add(sublime.Region(int(pt) if preview_is_on_left() else int(pt) - int(v[1])))
-                    view.settings().set('color_helper.no_auto', True)
-                    view.run_command('color_helper', {"mode": "info"})
-                break
+        record = get_preview_state(view).ids.get(href)
+        if record is not None:
+            phantoms = view.query_phantom(record.phantom.id)
+            if phantoms:
+                pt = phantoms[0].begin()
+                view.sel().add(sublime.Region(pt if preview_is_on_left() else pt - record.length))
+                view.settings().set('color_helper.no_auto', True)
+                view.run_command('color_helper', {"mode": "info"})
 
     def do_search(self, view, force=False):
         """Perform the search for the highlighted word."""
 
+        start = time()
+
         # Since the plugin has been reloaded, force update.
         global reload_flag
         if reload_flag:
@@ -1067,7 +1474,7 @@ class ChPreview(object):
             top_pad = 0
         if bottom_pad is None:
             bottom_pad = 0
-        old_box_height = int(settings.get('color_helper.box_height', 0))
+        state = get_preview_state(view)
         box_height = util.get_line_height(view) - int(top_pad + bottom_pad) + size_offset
         check_size = int((box_height - 4) / 4)
         current_color_scheme = settings.get('color_scheme')
@@ -1077,286 +1484,678 @@ class ChPreview(object):
 
         # If desired preview boxes are different than current,
         # we need to reload the boxes.
-        if old_box_height != box_height or current_color_scheme != settings.get('color_helper.color_scheme', ''):
+        if state.box_height != box_height or state.color_scheme != current_color_scheme:
+            if state.box_height:
+                # Line height or color scheme changed, so cached images are outdated.
+                util.color_box_cache.clear()
             self.erase_phantoms(view)
-            settings.set('color_helper.color_scheme', current_color_scheme)
-            settings.set('color_helper.box_height', box_height)
-            settings.set('color_helper.preview_meta', {})
+            state.color_scheme = current_color_scheme
+            state.box_height = box_height
             force = True
 
-        # If we don't need to force previews,
-        # quit if visible region is the same as last time
+        # Get the rules and the scan mode of the view.
+        # In a degraded mode, previews are only kept in the viewport (or the column window
+        # of a minified view) and their number is capped.  As the viewport of a minified view
+        # is mostly one line, its column window is always scanned in full.
         visible_region = view.visible_region()
-        if not force and self.previous_region == visible_region:
+        rules = util.get_rules(view)
+        mode = update_scan_mode(view, rules)
+        limit = None
+        bounds = visible_region
+        column = None
+        if mode != SCAN_MODE_NORMAL:
+            limit = rules.get('max_previews', SCAN_LIMITS['max_previews'])
+            if mode == SCAN_MODE_MINIFIED:
+                bounds = column = self.get_column_window(view, visible_region, rules)
+        previous_column = state.previous_column
+        state.previous_column = column
+
+        # Continue the unfinished job unless the view has changed under it.
+        # If the view has changed, drop the job and rescan the whole viewport.
+        if self.job is not None:
+            if not force and previous_column == column and self.job.is_current(view, visible_region):
+                self.render(view)
+                return
+            if self.job.area is None:
+                force = True
+            self.job = None
+
+        # If we don't need to force previews and nothing was edited,
+        # quit if visible region is the same as last time
+        if (
+            not force and state.dirty is None and
+            state.previous_region == visible_region and previous_column == column
+        ):
             return
-        self.previous_region = visible_region
+        previous_region = state.previous_region
+        state.previous_region = visible_region
+        if mode == SCAN_MODE_MINIFIED:
+            force = True
 
         # Get the current preview positions so we don't insert doubles
-        preview = settings.get('color_helper.preview_meta', {})
+        preview = state.previews
+        retired = self.retire_phantoms(view, visible_region, state, bounds if limit is not None else None)
 
-        # Get the rules and use them to get the needed scopes.
+        # Get the needed scopes from the rules.
         # The scopes will be used to get the searchable regions.
-        rules = util.get_rules(view)
+        # Windows covered by prefetched previews don't need to be searched.
         scope = util.get_scope(view, rules, skip_sel_check=True)
         source = []
+        cached = []
+        position_on_left = preview_is_on_left()
         if scope:
-            for r in view.find_by_selector(scope):
-                if r.end() < visible_region.begin():
-                    continue
-                if r.begin() > visible_region.end():
+            scan_regions = get_scan_regions(view, scope)
+            for w in self.get_scan_windows(view, previous_region, visible_region, force, state.dirty):
+                if mode == SCAN_MODE_MINIFIED:
+                    w = sublime.Region(max(w.begin(), bounds.begin()), min(w.end(), bounds.end()))
+                    if w.begin() >= w.end():
+                        continue
+                prefetched = state.get_prefetched(view, w)
+                if prefetched is not None:
+                    cached.extend(prefetched)
                     continue
-                if r.begin() < visible_region.begin():
-                    start = max(visible_region.begin() - 20, 0)
-                    if r.end() > visible_region.end():
-                        end = min(visible_region.end() + 20, view.size())
-                    else:
-                        end = r.end()
-                    r = sublime.Region(start, end)
-                elif r.end() > visible_region.end():
-                    r = sublime.Region(r.begin(), min(visible_region.end() + 20, view.size()))
-                source.append(r)
+                for r in scan_regions.query(w.begin(), w.end()):
+                    source.append(sublime.Region(max(r.begin(), w.begin()), min(r.end(), w.end())))
         else:
             # Nothing to search for
             self.erase_phantoms(view)
 
-        if source:
+        colors = []
+        for record in cached:
+            pt = record.point
+            if limit is not None and len(preview) + len(colors) >= limit:
+                break
+            if pt in preview:
+                continue
+            color_start = pt if position_on_left else pt - record.length
+            if visible_region.contains(sublime.Region(color_start, color_start + record.length)):
+                colors.append(record)
+        if colors:
+            self.add_phantoms(view, colors, state)
+            retired = True
+
+        if scope:
             # See what colors are allowed
-            self.allowed_colors = set(rules.get('allowed_colors', []))
+            color_re = get_view_scanner(view, rules).color_re
             use_hex_argb = rules.get('use_hex_argb', False)
 
-            # Find the colors
-            colors = []
-            for src in source:
-                text = view.substr(src)
-                for m in util.COLOR_RE.finditer(text):
-                    src_start = src.begin() + m.start(0)
-                    src_end = src.begin() + m.end(0)
-                    position_on_left = preview_is_on_left()
-                    pt = src_start if position_on_left else src_end
-                    if str(pt) in preview:
-                        continue
-                    elif not visible_region.contains(sublime.Region(src.begin() + m.start(0), src.begin() + m.end(0))):
-                        continue
-                    elif m.group('hex_compressed'):
-                        if not self.color_okay('hex_compressed'):
-                            continue
-                        color_type = 'hex_compressed'
-                    elif m.group('hexa_compressed'):
-                        if not self.color_okay('hexa_compressed'):
-                            continue
-                        color_type = 'hexa_compressed'
-                    elif m.group('hex'):
-                        if not self.color_okay('hex'):
-                            continue
-                        color_type = 'hex'
-                    elif m.group('hexa'):
-                        if not self.color_okay('hexa'):
-                            continue
-                        color_type = 'hexa'
-                    elif m.group('rgb'):
-                        if not self.color_okay('rgb'):
-                            continue
-                        color_type = 'rgb'
-                    elif m.group('rgba'):
-                        if not self.color_okay('rgba'):
-                            continue
-                        color_type = 'rgba'
-                    elif m.group('gray'):
-                        if not self.color_okay('gray'):
-                            continue
-                        color_type = 'gray'
-                    elif m.group('graya'):
-                        if not self.color_okay('graya'):
-                            continue
-                        color_type = 'graya'
-                    elif m.group('hsl'):
-                        if not self.color_okay('hsl'):
-                            continue
-                        color_type = 'hsl'
-                    elif m.group('hsla'):
-                        if not self.color_okay('hsla'):
-                            continue
-                        color_type = 'hsla'
-                    elif m.group('hwb'):
-                        if not self.color_okay('hwb'):
-                            continue
-                        color_type = 'hwb'
-                    elif m.group('hwba'):
-                        if not self.color_okay('hwba'):
-                            continue
-                        color_type = 'hwba'
-                    elif m.group('webcolors'):
-                        if not self.color_okay('webcolors'):
-                            continue
-                        color_type = 'webcolors'
-                    else:
-                        continue
-                    color, alpha, alpha_dec = util.translate_color(m, use_hex_argb)
-                    color += alpha if alpha is not None else 'ff'
-                    no_alpha_color = color[:-2] if len(color) > 7 else color
-                    scope = view.scope_name(pt)
-                    start_scope = view.scope_name(src_start)
-                    end_scope = view.scope_name(src_end - 1)
-                    rgba = RGBA(mdpopups.scope2style(view, scope)['background'])
-                    rgba.brightness(1.1 if rgba.get_luminance() <= 127 else .9)
-                    preview_id = str(time())
-                    color = '<style>html, body {margin: 0; padding:0;}</style><a href="%s">%s</a>' % (
-                        preview_id,
-                        mdpopups.color_box(
-                            [no_alpha_color, color], rgba.get_rgb(),
-                            height=box_height, width=box_height,
-                            border_size=PREVIEW_BORDER_SIZE, check_size=check_size
-                        )
-                    )
-                    colors.append(
-                        (
-                            color, pt, hash(m.group(0)), len(m.group(0)),
-                            color_type, hash(start_scope + ':' + end_scope),
-                            preview_id
-                        )
+        if source:
+            # Find the colors and sort them so the nearest to the center is popped first.
+            # Colors touching the edges of a column window may be cut, so they are skipped.
+            if mode == SCAN_MODE_MINIFIED:
+                center = (bounds.begin() + bounds.end()) // 2
+                bounds = sublime.Region(
+                    bounds.begin() + int(bounds.begin() > visible_region.begin()),
+                    bounds.end() - int(bounds.end() < visible_region.end())
+                )
+            else:
+                center = self.get_center(view, visible_region)
+            matches = self.find_colors(view, source, color_re, preview, position_on_left, bounds)
+            matches.sort(key=lambda x: abs(center - x[0]), reverse=True)
+
+            self.job = ChPreviewJob(
+                view, visible_region, matches, color_re, box_height, check_size, use_hex_argb, position_on_left, start
+            )
+            self.job.limit = limit
+            self.render(view, retired)
+        else:
+            if retired:
+                self.apply_phantoms(view, state)
+            if scope:
+                self.start_prefetch(
+                    view, visible_region, color_re, box_height, check_size, use_hex_argb, position_on_left, scope
+                )
+
+        if scope:
+            if mode == SCAN_MODE_NORMAL:
+                state.take_snapshot(view, visible_region, position_on_left)
+            else:
+                state.snapshot = None
+                state.dirty = None
+
+    def find_colors(self, view, source, color_re, preview, position_on_left, bounds):
+        """Find the colors in the source regions that are within the bounds and don't have a preview yet."""
+
+        matches = []
+        for src in source:
+            for src_start, src_end, m in scanner.find_colors(
+                view.substr(src), src.begin(), color_re, bounds.begin(), bounds.end()
+            ):
+                if (src_start if position_on_left else src_end) not in preview:
+                    matches.append((src_start, src_end, m))
+        return matches
+
+    def start_prefetch(
+        self, view, visible_region, color_re, box_height, check_size, use_hex_argb, position_on_left, scope
+    ):
+        """
+        Start a job that builds the previews `preview_prefetch_screens` screens above and below the viewport.
+
+        The previews are only cached; scrolling into the area applies them without searching or rendering.
+        Cached previews outside of the area are dropped.
+        """
+
+        screens = max(int(ch_settings.get('preview_prefetch_screens', 1)), 0)
+        if not screens or get_preview_state(view).mode == SCAN_MODE_MINIFIED:
+            return
+        first_row = view.rowcol(visible_region.begin())[0]
+        last_row = view.rowcol(visible_region.end())[0]
+        rows = (last_row - first_row + 1) * screens
+
+        # Don't prefetch again until the viewport gets within half the distance of the edge of the cached area.
+        state = get_preview_state(view)
+        change_count = view.change_count()
+        covered = state.prefetch_region
+        if state.prefetch_count == change_count and covered is not None:
+            needed = sublime.Region(
+                view.text_point(max(first_row - rows // 2, 0), 0),
+                view.line(min(view.text_point(last_row + rows // 2, 0), view.size())).end()
+            )
+            if covered.contains(needed):
+                return
+
+        begin = view.text_point(max(first_row - rows, 0), 0)
+        end = view.line(min(view.text_point(last_row + rows, 0), view.size())).end()
+        if state.prefetch_count != change_count:
+            state.clear_prefetch(change_count)
+        else:
+            state.prefetch = {pt: record for pt, record in state.prefetch.items() if begin <= pt <= end}
+            state.prefetch_region = None
+            state.prefetch_points = []
+
+        self.job = ChPreviewJob(
+            view, visible_region, None, color_re, box_height, check_size, use_hex_argb, position_on_left, time(),
+            sublime.Region(begin, end)
+        )
+        self.job.source = [
+            sublime.Region(max(r.begin(), begin), min(r.end(), end))
+            for r in get_scan_regions(view, scope).query(begin, end)
+        ]
+
+    def get_column_window(self, view, visible_region, rules):
+        """
+        Get the window of `max_line_length` characters around the center of the viewport of a minified view.
+
+        The center is snapped to a quarter of the window, so the small shifts caused by our own phantoms don't move it.
+        """
+
+        x, y = view.viewport_position()
+        width, height = view.viewport_extent()
+        half = max(rules.get('max_line_length', SCAN_LIMITS['max_line_length']) // 2, 2)
+        step = half // 2
+        center = int(round(view.layout_to_text((x + width / 2, y + height / 2)) / float(step))) * step
+        return sublime.Region(max(center - half, visible_region.begin()), min(center + half, visible_region.end()))
+
+    def get_center(self, view, visible_region):
+        """Get the caret if it is in the viewport, else the center of the viewport."""
+
+        sels = view.sel()
+        if len(sels) and visible_region.contains(sels[0]):
+            return sels[0].b
+        return (visible_region.begin() + visible_region.end()) // 2
+
+    def build_preview(self, view, state, job, src_start, src_end, m):
+        """Build the record of a preview (without its phantom), or `None` if the match isn't a valid color."""
+
+        position_on_left = job.position_on_left
+        box_height = job.box_height
+        pt = src_start if position_on_left else src_end
+        color_type, span, color = util.color_match(m, job.use_hex_argb)
+        if color is None:
+            return None
+        packed = util.pack_hex(color)
+        no_alpha_color = color[:-2]
+        start_scope = view.scope_name(src_start)
+        end_scope = view.scope_name(src_end - 1)
+        border = state.get_border(view, start_scope if position_on_left else view.scope_name(pt))
+        preview_id = str(next(ch_preview_ids))
+        content = '<style>html, body {margin: 0; padding:0;}</style><a href="%s">%s</a>' % (
+            preview_id,
+            util.color_box(
+                [no_alpha_color, color], border,
+                height=box_height, width=box_height,
+                border_size=PREVIEW_BORDER_SIZE, check_size=job.check_size
+            )
+        )
+        return ChPreviewRecord(
+            pt, content, packed, len(m.group(0)),
+            color_type, hash(start_scope + ':' + end_scope),
+            preview_id
+        )
+
+    def apply_phantoms(self, view, state):
+        """Apply the previews to the view."""
+
+        state.update_phantoms()
+        # The phantoms may have altered the viewable region,
+        # so set previous region to the current viewable region
+        state.previous_region = sublime.Region(state.previous_region.begin(), view.visible_region().end())
+
+    def render(self, view, update=False):
+        """
+        Render the previews of the job nearest first until the slice budget runs out.
+
+        The previews are applied at the end of each slice, so the first ones show up
+        without waiting for the whole viewport.  When the viewport is done, prefetching is started.
+        """
+
+        job = self.job
+        state = get_preview_state(view)
+        budget = max(int(ch_settings.get('preview_slice_budget', 20)), 1) / 1000.0
+        prefetch = job.area is not None
+        preview = state.prefetch if prefetch else state.previews
+        if job.matches is None:
+            # Search the prefetch area, nearest to the viewport first
+            center = (job.visible_region.begin() + job.visible_region.end()) // 2
+            job.matches = self.find_colors(
+                view, job.source, job.color_re, preview, job.position_on_left, job.area
+            )
+            job.matches.sort(key=lambda x: abs(center - x[0]), reverse=True)
+            return
+        start = time()
+        colors = []
+        while job.matches:
+            if job.limit is not None and len(preview) + len(colors) >= job.limit:
+                job.matches = []
+                break
+            src_start, src_end, m = job.matches.pop()
+            if (src_start if job.position_on_left else src_end) in preview:
+                continue
+            record = self.build_preview(view, state, job, src_start, src_end, m)
+            if record is not None:
+                state.cache_preview(job.change_count, record)
+                if not prefetch:
+                    colors.append(record)
+            if time() - start >= budget:
+                break
+
+        if prefetch:
+            if not job.matches:
+                self.job = None
+                state.prefetch_region = job.area
+                state.prefetch_points = sorted(state.prefetch)
+            return
+
+        if colors:
+            self.add_phantoms(view, colors, state)
+            update = True
+        if update:
+            self.apply_phantoms(view, state)
+        if colors and not job.rendered:
+            job.rendered = True
+            self.first_preview_times.append((time() - job.start) * 1000.0)
+
+        if not job.matches:
+            self.job = None
+            util.debug('Translate cache: ', util.translate_cache.stats())
+            util.debug('Color box cache: ', util.color_box_cache.stats())
+            if self.first_preview_times:
+                util.debug(
+                    'Time to first preview: p50 %.1f ms, p95 %.1f ms (%d samples)' % (
+                        percentile(self.first_preview_times, 50),
+                        percentile(self.first_preview_times, 95),
+                        len(self.first_preview_times)
                     )
+                )
+            rules = util.get_rules(view)
+            scope = util.get_scope(view, rules, skip_sel_check=True)
+            if scope:
+                self.start_prefetch(
+                    view, job.visible_region, get_view_scanner(view, rules).color_re, job.box_height, job.check_size,
+                    job.use_hex_argb, job.position_on_left, scope
+                )
 
-            self.add_phantoms(view, colors, preview)
-            settings.set('color_helper.preview_meta', preview)
+    def get_scan_windows(self, view, previous_region, visible_region, force=False, dirty=None):
+        """
+        Get the regions of the viewport that need to be scanned.
+
+        Unless forced, only the part of the viewport that was not visible last time is scanned,
+        plus everything from the first edited line (`dirty`) on, as text after an edit may have moved.
+        Windows are expanded to whole lines plus a line of context so colors crossing
+        the edges are found and no color is cut in half.
+        """
+
+        if (
+            force or previous_region.size() == 0 or
+            previous_region.end() < visible_region.begin() or previous_region.begin() > visible_region.end() or
+            (dirty is not None and dirty <= visible_region.begin())
+        ):
+            exposed = [visible_region]
+        else:
+            exposed = []
+            if visible_region.begin() < previous_region.begin():
+                exposed.append(sublime.Region(visible_region.begin(), previous_region.begin()))
+            if visible_region.end() > previous_region.end():
+                exposed.append(sublime.Region(previous_region.end(), visible_region.end()))
+            if dirty is not None and dirty < visible_region.end():
+                exposed.append(sublime.Region(dirty, visible_region.end()))
+                exposed.sort(key=lambda r: r.begin())
+
+        size = view.size()
+        windows = []
+        for r in exposed:
+            begin = view.line(r.begin()).begin()
+            if begin > 0:
+                begin = view.line(begin - 1).begin()
+            end = view.line(r.end()).end()
+            if end < size:
+                end = view.line(end + 1).end()
+            if windows and begin <= windows[-1].end():
+                windows[-1] = sublime.Region(windows[-1].begin(), max(end, windows[-1].end()))
+            else:
+                windows.append(sublime.Region(begin, end))
+        return windows
 
-            # The phantoms may have altered the viewable region,
-            # so set previous region to the current viewable region
-            self.previous_region = sublime.Region(self.previous_region.begin(), view.visible_region().end())
+    def retire_phantoms(self, view, visible_region, state, bounds=None):
+        """
+        Erase previews that are further than the retire margin (in lines) outside the viewport.
 
-    def add_phantoms(self, view, colors, preview):
-        """Add phantoms."""
+        This keeps the number of phantoms bounded by the size of the screen.
+        In a degraded scan mode, all previews outside of the `bounds` are erased.
+        Returns whether any previews were retired.
+        """
 
-        for color in colors:
-            pid = view.add_phantom(
-                'color_helper',
-                sublime.Region(color[1]),
-                color[0],
-                0,
+        preview = state.previews
+        if not preview:
+            return False
+
+        if bounds is not None:
+            begin = bounds.begin()
+            end = bounds.end()
+        else:
+            margin = max(int(ch_settings.get('preview_retire_margin', 100)), 0)
+            first_row = max(view.rowcol(visible_region.begin())[0] - margin, 0)
+            last_row = view.rowcol(visible_region.end())[0] + margin
+            begin = view.text_point(first_row, 0)
+            end = view.line(min(view.text_point(last_row, 0), view.size())).end()
+
+        keys = list(preview.keys())
+        retired = False
+        for key, region in zip(keys, view.query_phantoms([preview[k].phantom.id for k in keys])):
+            if region.begin() < begin or region.begin() > end:
+                del state.ids[preview.pop(key).preview_id]
+                retired = True
+        return retired
+
+    def add_phantoms(self, view, colors, state):
+        """Add the previews (the phantoms are applied with the next phantom set update)."""
+
+        for record in colors:
+            record.phantom = sublime.Phantom(
+                sublime.Region(record.point),
+                record.content,
+                sublime.LAYOUT_INLINE,
                 on_navigate=lambda href, view=view: self.on_navigate(href, view)
             )
-            preview[str(color[1])] = [color[2], color[3], color[4], color[5], pid, color[6]]
-
-    def reset_previous(self):
-        """Reset previous region."""
-        self.previous_region = sublime.Region(0)
+            state.previews[record.point] = record
+            state.ids[record.preview_id] = record
 
     def erase_phantoms(self, view, incremental=False):
         """Erase phantoms."""
 
         altered = False
         if incremental:
-            # Edits can potentially move the position of all the previews.
+            # Previews that end before the first edited line can't be affected by the edit:
+            # their position, text, and scope are unchanged, so they are kept without any work.
+            # The rest can potentially have moved.
             # We need to grab the phantom by their id and then apply the color regex
             # on the phantom range +/- some extra characters so we can catch word boundaries.
             # Clear the phantom if any of the follwoing:
             #    - Phantom can't be found
             #    - regex doesn't match
             #    - regex group doesn't match color type
-            #    - match doesn't start at the same point
-            #    - hash result is wrong
+            #    - match doesn't start at the same point or has a different length
+            #    - packed color is wrong
             # Update preview meta data with new results
-            old_preview = view.settings().get('color_helper.preview_meta', {})
+            state = get_preview_state(view)
+            dirty = state.get_dirty_begin(view)
+            if dirty is None:
+                return
+            state.dirty = dirty if state.dirty is None else min(state.dirty, dirty)
+            old_preview = state.previews
             position_on_left = preview_is_on_left()
+            rules = util.get_rules(view)
+            use_hex_argb = rules.get('use_hex_argb', False) if rules else False
             preview = {}
-            for k, v in old_preview.items():
-                phantoms = view.query_phantom(v[4])
-                pt = phantoms[0].begin() if phantoms else None
-                if pt is None:
-                    view.erase_phantom_by_id(v[4])
+            records = []
+            for pt, v in old_preview.items():
+                if (pt + v.length if position_on_left else pt) < dirty:
+                    preview[pt] = v
+                else:
+                    records.append(v)
+            size = view.size()
+            for v, region in zip(records, view.query_phantoms([record.phantom.id for record in records])):
+                pt = region.begin()
+                if pt == -1:
+                    del state.ids[v.preview_id]
                     altered = True
                 else:
-                    color_start = pt if position_on_left else pt - v[1]
-                    color_end = pt + v[1] if position_on_left else pt
+                    color_start = pt if position_on_left else pt - v.length
+                    color_end = pt + v.length if position_on_left else pt
                     approx_color_start = color_start - 5
                     if approx_color_start < 0:
                         approx_color_start = 0
                     approx_color_end = color_end + 5
-                    if approx_color_end > view.size():
-                        approx_color_end = view.size()
+                    if approx_color_end > size:
+                        approx_color_end = size
                     text = view.substr(sublime.Region(approx_color_start, approx_color_end))
-                    m = util.COLOR_RE.search(text)
+                    color = scanner.validate_color(
+                        text, approx_color_start, color_start, v.length, v.color_type, use_hex_argb
+                    )
                     if (
-                        not m or
-                        not m.group(v[2]) or
-                        approx_color_start + m.start(0) != color_start or
-                        hash(m.group(0)) != v[0] or
-                        v[3] != hash(view.scope_name(color_start) + ':' + view.scope_name(color_end - 1)) or
-                        str(pt) in preview
+                        color is None or
+                        util.pack_hex(color) != v.color or
+                        v.scope_hash != hash(view.scope_name(color_start) + ':' + view.scope_name(color_end - 1)) or
+                        pt in preview
                     ):
-                        view.erase_phantom_by_id(v[4])
+                        del state.ids[v.preview_id]
                         altered = True
                     else:
-                        preview[str(pt)] = v
-            view.settings().set('color_helper.preview_meta', preview)
+                        v.point = pt
+                        preview[pt] = v
+            state.previews = preview
+            if altered:
+                state.update_phantoms()
         else:
             # Obliterate!
             view.erase_phantoms('color_helper')
-            view.settings().set('color_helper.preview_meta', {})
-            altered = True
-        if altered:
-            self.reset_previous()
+            get_preview_state(view).reset(view)
+            self.job = None
 
-    def color_okay(self, color_type):
-        """Check if color is allowed."""
 
-        return color_type in self.allowed_colors
+class ChScheduler(threading.Thread):
+    """
+    Debounced, event driven scheduler.
 
+    Events wake the thread through a condition variable, and the payload is dispatched
+    once no new events have come in for the debounce delay.  With nothing pending,
+    the thread blocks without a timeout, so an idle scheduler never wakes up.
+    """
 
-class ChPreviewThread(threading.Thread):
-    """Load up defaults."""
+    main_thread = False
 
     def __init__(self):
         """Setup the thread."""
+
+        self.condition = threading.Condition()
         self.reset()
         threading.Thread.__init__(self)
 
     def reset(self):
         """Reset the thread variables."""
-        self.wait_time = 0.12
+
+        self.configure()
         self.time = time()
-        self.modified = False
+        self.last_poll = self.time
+        self.pending = False
+        self.busy = False
         self.ignore_all = False
-        self.clear = False
         self.abort = False
+        self.idle = False
+        self.polled = False
+        self.wakeups = 0
+
+    def configure(self):
+        """Read the debounce delay and the poll interval (seconds) from the settings."""
+
+        s = sublime.load_settings('color_helper.sublime-settings')
+        self.debounce = max(int(s.get('event_debounce', 120)), 0) / 1000.0
+        self.poll_interval = None
+
+    def schedule(self):
+        """Schedule the payload to run after the debounce delay."""
+
+        with self.condition:
+            self.time = time()
+            self.pending = True
+            self.condition.notify()
+
+    def get_timeout(self):
+        """Get the seconds until the payload is due, or `None` if nothing is due."""
+
+        if self.busy:
+            return None
+        now = time()
+        timeouts = []
+        if self.pending:
+            timeouts.append(self.time + self.debounce - now)
+        if self.poll_interval:
+            timeouts.append(self.last_poll + self.poll_interval - now)
+        return min(timeouts) if timeouts else None
+
+    def dispatch(self):
+        """Run the payload and let the scheduler know when it is done."""
+
+        try:
+            self.payload()
+        except Exception:
+            print('ColorHelper: \n' + str(traceback.format_exc()))
+        with self.condition:
+            self.busy = False
+            self.last_poll = time()
+            self.condition.notify()
+
+    def payload(self):
+        """Code to run."""
+
+    def kill(self):
+        """Kill thread."""
+
+        with self.condition:
+            self.abort = True
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+        self.reset()
+
+    def run(self):
+        """Thread loop."""
+
+        while True:
+            with self.condition:
+                while True:
+                    if self.abort:
+                        return
+                    timeout = self.get_timeout()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    idle = timeout is None and not self.busy
+                    if idle and not self.idle:
+                        util.debug('%s idle after %d wakeups' % (self.__class__.__name__, self.wakeups))
+                    self.idle = idle
+                    self.condition.wait(timeout)
+                    self.wakeups += 1
+                self.idle = False
+                self.polled = not self.pending
+                self.pending = False
+                self.busy = True
+            if self.main_thread:
+                sublime.set_timeout(self.dispatch, 0)
+            else:
+                sublime.set_timeout_async(self.dispatch, 0)
+
+
+class ChPreviewThread(ChScheduler):
+    """
+    Schedule preview updates.
+
+    Edits clear stale previews and search for new ones, while selection and
+    activation events only search.  Sublime Text doesn't report scrolling,
+    so the viewport of the active view with previews is also checked at the configured interval.
+    The check only searches if the view, its change count, or its viewport changed, and
+    the interval is backed off while nothing changes.  Checks stop when the view is deactivated.
+    """
+
+    def reset(self):
+        """Reset the thread variables."""
+
+        ChScheduler.reset(self)
+        self.modified = False
+        self.watch_viewport = False
+        self.resume = False
+        self.viewport = None
+        self.idle_polls = 0
 
-    def payload(self, clear=False, force=False):
+    def configure(self):
+        """Read the debounce delay and the viewport interval (seconds) from the settings."""
+
+        ChScheduler.configure(self)
+        s = sublime.load_settings('color_helper.sublime-settings')
+        self.viewport_interval = max(int(s.get('preview_viewport_interval', 500)), 0) / 1000.0
+
+    def get_timeout(self):
+        """Resume an unfinished preview job right away, unless new events are waiting for the debounce."""
+
+        if self.resume and not self.busy and not self.pending:
+            return 0
+        return ChScheduler.get_timeout(self)
+
+    def modify(self):
+        """Schedule a clear of stale previews followed by a search."""
+
+        self.modified = True
+        self.schedule()
+
+    def pause(self):
+        """Stop checking the viewport until the next event."""
+
+        with self.condition:
+            self.poll_interval = None
+            self.viewport = None
+            self.condition.notify()
+
+    def payload(self):
         """Code to run."""
 
-        if clear:
-            self.modified = False
+        clear = self.modified
+        self.modified = False
+        polled = self.polled and not self.resume
         # Ignore selection and edit events inside the routine
         self.ignore_all = True
+        watch = False
+        self.resume = False
         if ch_preview is not None:
             try:
                 view = sublime.active_window().active_view()
                 if view:
-                    if not clear:
-                        ch_preview.do_search(view, force)
+                    viewport = (view.id(), view.change_count(), view.viewport_position(), view.viewport_extent())
+                    if polled and not clear and viewport == self.viewport:
+                        # Nothing changed since the last check, so check less often.
+                        self.idle_polls += 1
                     else:
-                        ch_preview.erase_phantoms(view, incremental=True)
+                        self.idle_polls = 0
+                        if clear:
+                            ch_preview.erase_phantoms(view, incremental=True)
+                        ch_preview.do_search(view)
+                        self.resume = ch_preview.job is not None
+                        self.viewport = viewport
+                    watch = util.get_rules(view) is not None
             except Exception:
                 print('ColorHelper: \n' + str(traceback.format_exc()))
         self.ignore_all = False
-        self.time = time()
-
-    def kill(self):
-        """Kill thread."""
-
-        self.abort = True
-        while self.is_alive():
-            pass
-        self.reset()
-
-    def run(self):
-        """Thread loop."""
-
-        while not self.abort:
-            if not self.ignore_all:
-                if self.modified is True and (time() - self.time) > self.wait_time:
-                    sublime.set_timeout_async(lambda: self.payload(clear=True), 0)
-                elif not self.modified:
-                    sublime.set_timeout_async(self.payload, 0)
-            sleep(0.5)
+        self.poll_interval = (
+            self.viewport_interval * min(2 ** self.idle_polls, PREVIEW_VIEWPORT_BACKOFF) if watch else None
+        )
 
 
 class ColorHelperListener(sublime_plugin.EventListener):
@@ -1368,23 +2167,27 @@ class ColorHelperListener(sublime_plugin.EventListener):
         if self.ignore_event(view):
             return
 
-        if ch_preview_thread is not None:
-            now = time()
-            ch_preview_thread.modified = True
-            ch_preview_thread.time = now
+        index = ch_file_index.get(view.id())
+        if index is not None:
+            index.modified = True
+        ch_scan_regions.pop(view.id(), None)
+
+        if ch_preview_thread is not None and not ch_preview_thread.ignore_all:
+            ch_preview_thread.modify()
 
         self.on_selection_modified(view)
 
     def on_selection_modified(self, view):
-        """Flag that we need to show a tooltip."""
+        """Flag that we need to show a tooltip and that the viewport may have moved."""
 
         if self.ignore_event(view):
             return
 
         if not ch_thread.ignore_all:
-            now = time()
-            ch_thread.modified = True
-            ch_thread.time = now
+            ch_thread.schedule()
+
+        if ch_preview_thread is not None and not ch_preview_thread.ignore_all:
+            ch_preview_thread.schedule()
 
     def set_file_scan_rules(self, view):
         """Set the scan rules for the current view."""
@@ -1399,6 +2202,7 @@ class ColorHelperListener(sublime_plugin.EventListener):
         allowed_colors = set()
         use_hex_argb = False
         compress_hex = False
+        limits = {}
 
         for rule in rules:
             results = []
@@ -1429,23 +2233,17 @@ class ColorHelperListener(sublime_plugin.EventListener):
             if False not in results:
                 scan_scopes += rule.get("scan_scopes", [])
                 incomplete_scopes += rule.get("scan_completion_scopes", [])
-                for color in rule.get("allowed_colors", []):
-                    if color == "css3":
-                        for c in util.CSS3:
-                            allowed_colors.add(c)
-                    elif color == "css4":
-                        for c in util.CSS4:
-                            allowed_colors.add(c)
-                    elif color == "all":
-                        for c in util.ALL:
-                            allowed_colors.add(c)
-                    else:
-                        allowed_colors.add(color)
+                allowed_colors |= project.get_allowed_colors(rule.get("allowed_colors", []))
                 if not use_hex_argb and rule.get("use_hex_argb", False):
                     use_hex_argb = True
                 if not compress_hex and rule.get("compress_hex_output", False):
                     compress_hex = True
+                for key in SCAN_LIMITS:
+                    value = rule.get(key)
+                    if value is not None:
+                        limits[key] = min(limits.get(key, value), value)
         if scan_scopes or incomplete_scopes:
+            ch_scanners[view.id()] = scanner.get_scanner(allowed_colors)
             view.settings().set(
                 'color_helper.scan',
                 {
@@ -1455,12 +2253,16 @@ class ColorHelperListener(sublime_plugin.EventListener):
                     "allowed_colors": list(allowed_colors),
                     "use_hex_argb": use_hex_argb,
                     "compress_hex_output": compress_hex,
+                    "max_file_size": limits.get("max_file_size", SCAN_LIMITS["max_file_size"]),
+                    "max_line_length": limits.get("max_line_length", SCAN_LIMITS["max_line_length"]),
+                    "max_previews": limits.get("max_previews", SCAN_LIMITS["max_previews"]),
                     "current_ext": ext,
                     "current_syntax": syntax,
                     "last_updated": ch_last_updated
                 }
             )
         else:
+            ch_scanners.pop(view.id(), None)
             view.settings().set(
                 'color_helper.scan',
                 {
@@ -1475,6 +2277,7 @@ class ColorHelperListener(sublime_plugin.EventListener):
                 view.settings().add_on_change(
                     'color_helper.reload', lambda view=view: self.on_view_settings_change(view)
                 )
+        update_scan_mode(view, util.get_rules(view))
 
     def should_update(self, view):
         """Check if an update should be performed."""
@@ -1505,17 +2308,22 @@ class ColorHelperListener(sublime_plugin.EventListener):
         """Run current file scan and/or project scan if not run before."""
 
         if self.ignore_event(view):
-            if view.settings().get('color_helper.preview_meta', {}):
-                view.settings().erase('color_helper.preview_meta')
+            clear_preview_state(view)
             return
 
+        # Highlighting may have finished since the regions were cached.
+        ch_scan_regions.pop(view.id(), None)
+
+        if ch_preview_thread is not None:
+            ch_preview_thread.schedule()
+
         if self.should_update(view):
             self.set_file_scan_rules(view)
             s = sublime.load_settings('color_helper.sublime-settings')
             show_current_palette = s.get('enable_current_file_palette', True)
             view.settings().set('color_helper.file_palette', [])
             if show_current_palette:
-                start_file_index(view)
+                start_file_index(view, full=True)
 
     def on_view_settings_change(self, view):
         """Post text command event to catch syntax setting."""
@@ -1528,26 +2336,28 @@ class ColorHelperListener(sublime_plugin.EventListener):
                 old_syntax = rules.get("current_syntax")
                 if old_syntax is None or old_syntax != syntax:
                     self.on_activated(view)
-                if settings.get('color_scheme') != settings.get('color_helper.color_scheme', ''):
-                    settings.erase('color_helper.preview_meta')
+                state = ch_preview_state.get(view.id())
+                if state is not None and settings.get('color_scheme') != state.color_scheme:
+                    util.color_box_cache.clear()
+                    clear_preview_state(view)
                     view.erase_phantoms('color_helper')
 
     def on_post_save(self, view):
         """Run current file scan and/or project scan on save."""
 
         if self.ignore_event(view):
-            if view.settings().get('color_helper.preview_meta', {}):
-                view.settings().erase('color_helper.preview_meta')
+            clear_preview_state(view)
             return
 
         s = sublime.load_settings('color_helper.sublime-settings')
         show_current_palette = s.get('enable_current_file_palette', True)
-        if self.should_update(view):
-            view.settings().erase('color_helper.preview_meta')
+        full = self.should_update(view)
+        if full:
+            clear_preview_state(view)
             view.erase_phantoms('color_helper')
             self.set_file_scan_rules(view)
         if show_current_palette:
-            start_file_index(view)
+            start_file_index(view, full=full)
 
     def on_clone(self, view):
         """Run current file scan on clone."""
@@ -1557,7 +2367,25 @@ class ColorHelperListener(sublime_plugin.EventListener):
         s = sublime.load_settings('color_helper.sublime-settings')
         show_current_palette = s.get('enable_current_file_palette', True)
         if show_current_palette:
-            start_file_index(view)
+            start_file_index(view, full=True)
+
+    def on_deactivated(self, view):
+        """Stop checking the viewport of a view that is no longer active."""
+
+        if self.ignore_event(view):
+            return
+
+        if ch_preview_thread is not None:
+            ch_preview_thread.pause()
+
+    def on_close(self, view):
+        """Release the color index of the closed view."""
+
+        ch_file_index.pop(view.id(), None)
+        ch_scan_regions.pop(view.id(), None)
+        ch_scanners.pop(view.id(), None)
+        ch_cursor_colors.pop(view.id(), None)
+        clear_preview_state(view)
 
     def ignore_event(self, view):
         """Check if event should be ignored."""
@@ -1565,31 +2393,72 @@ class ColorHelperListener(sublime_plugin.EventListener):
         return view.settings().get('is_widget', False) or ch_thread is None
 
 
+class ChScanRegions(object):
+    """
+    Sorted scannable regions of a view.
+
+    `find_by_selector` returns the regions in order, so the regions that intersect
+    a range can be found with a binary search on the (running maximum of the) region ends.
+    Regions are cached per view and rebuilt when the change count or the scope changes.
+    """
+
+    def __init__(self, view, scope):
+        """Find the scannable regions."""
+
+        self.change_count = view.change_count()
+        self.scope = scope
+        self.regions = view.find_by_selector(scope)
+        self.ends = list(accumulate((r.end() for r in self.regions), max))
+
+    def is_current(self, view, scope):
+        """Check if the regions are still valid for the view and scope."""
+
+        return self.change_count == view.change_count() and self.scope == scope
+
+    def query(self, begin, end):
+        """Get the regions that intersect the given range."""
+
+        regions = self.regions
+        count = len(regions)
+        index = bisect.bisect_left(self.ends, begin)
+        found = []
+        while index < count and regions[index].begin() <= end:
+            found.append(regions[index])
+            index += 1
+        return found
+
+
 class ChFileIndexThread(threading.Thread):
     """Load up defaults."""
 
-    def __init__(self, view, source, allowed_colors, use_hex_argb):
+    def __init__(self, view, index, source, rows, allowed_colors, use_hex_argb):
         """Setup the thread."""
 
         self.abort = False
         self.view = view
+        self.index = index
+        self.rows = rows
+        self.change_count = view.change_count()
         self.use_hex_argb = use_hex_argb
         self.allowed_colors = set(allowed_colors) if not isinstance(allowed_colors, set) else allowed_colors
-        self.webcolor_names = re.compile(
-            r'\b(%s)\b' % '|'.join(
-                [name for name in csscolors.name2hex_map.keys()]
-            )
-        )
         self.source = source
         threading.Thread.__init__(self)
 
-    def update_index(self, view, colors):
+    def update_index(self, view, colors, ends):
         """Code to run."""
 
         try:
-            colors.sort()
-            view.settings().set('color_helper.file_palette', colors)
-            util.debug('Colors:\n', colors)
+            if ch_file_index.get(view.id()) is not self.index:
+                return
+            if view.change_count() != self.change_count:
+                # The buffer changed while we were scanning,
+                # so the rows we found may no longer line up.
+                self.index.rebuild = True
+                return
+            self.index.update_rows(self.rows, colors, ends)
+            view.settings().set('color_helper.file_palette', list(self.index.palette))
+            util.debug('Colors:\n', util.format_palette_colors(self.index.palette))
+            util.debug('Translate cache: ', util.translate_cache.stats())
             s = sublime.load_settings('color_helper.sublime-settings')
             if s.get('show_index_status', True):
                 sublime.status_message('File color index complete...')
@@ -1609,93 +2478,116 @@ class ChFileIndexThread(threading.Thread):
         if self.source:
             self.index_colors()
 
-    def color_okay(self, color_type):
-        """Check if color is allowed."""
-
-        return color_type in self.allowed_colors
-
     def index_colors(self):
-        """Index colors in file."""
+        """Index colors in file by row."""
 
-        colors = set()
-        for m in util.COLOR_RE.finditer(self.source):
-            if self.abort:
-                break
-            if m.group('hex_compressed') and not self.color_okay('hex_compressed'):
-                continue
-            elif m.group('hexa_compressed') and not self.color_okay('hexa_compressed'):
-                continue
-            elif m.group('hex') and not self.color_okay('hex'):
-                continue
-            elif m.group('hexa') and not self.color_okay('hexa'):
-                continue
-            elif m.group('rgb') and not self.color_okay('rgb'):
-                continue
-            elif m.group('rgba') and not self.color_okay('rgba'):
-                continue
-            elif m.group('gray') and not self.color_okay('gray'):
-                continue
-            elif m.group('graya') and not self.color_okay('graya'):
-                continue
-            elif m.group('hsl') and not self.color_okay('hsl'):
-                continue
-            elif m.group('hsla') and not self.color_okay('hsla'):
-                continue
-            elif m.group('hwb') and not self.color_okay('hwb'):
-                continue
-            elif m.group('hwba') and not self.color_okay('hwba'):
-                continue
-            elif m.group('webcolors') and not self.color_okay('webcolors'):
-                continue
-            color, alpha, alpha_dec = util.translate_color(m, self.use_hex_argb)
-            color += alpha if alpha is not None else 'ff'
-            if not color.lower().endswith('ff'):
-                parts = alpha_dec.split('.')
-                dlevel = len(parts[1]) if len(parts) > 1 else None
-                if dlevel is not None:
-                    color += '@%d' % dlevel
-            colors.add(color)
-        if not self.abort:
+        found = scan_source(
+            self.source, scanner.get_scanner(self.allowed_colors).color_re, self.use_hex_argb, lambda: self.abort
+        )
+        if found is not None and not self.abort:
+            colors = {row: list(c) for row, c in found[0].items()}
             sublime.set_timeout(
-                lambda view=self.view, colors=list(colors): self.update_index(view, colors), 0
+                lambda view=self.view, colors=colors, ends=found[1]: self.update_index(view, colors, ends), 0
             )
 
 
-class ChThread(threading.Thread):
-    """Load up defaults."""
+class ChProjectIndexThread(threading.Thread):
+    """Index the colors of the project folders."""
 
-    def __init__(self):
+    def __init__(self, window, folders, rules, workers=0, python=''):
         """Setup the thread."""
 
-        self.reset()
+        self.abort = False
+        self.window = window
+        self.folders = folders
+        self.rules = rules
+        self.workers = workers
+        self.python = python
+        self.last_progress = 0
         threading.Thread.__init__(self)
 
+    def status(self, message):
+        """Show the status if enabled."""
+
+        s = sublime.load_settings('color_helper.sublime-settings')
+        if s.get('show_index_status', True):
+            sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+    def progress(self, done, total, fallback=False):
+        """Report the progress, at most every quarter second, and whether worker processes couldn't be used."""
+
+        now = time()
+        if done == total or now - self.last_progress > 0.25:
+            self.last_progress = now
+            self.status(
+                'Project color indexer: %d/%d files%s...' % (done, total, ' (sequential fallback)' if fallback else '')
+            )
+
+    def update_index(self, colors):
+        """Save the project palette."""
+
+        ch_project_palettes[self.window.id()] = colors
+        util.debug('Project colors:\n', util.format_palette_colors(colors))
+
+    def cancel(self):
+        """Cancel indexing without waiting."""
+
+        self.abort = True
+
+    def kill(self):
+        """Kill thread."""
+
+        self.abort = True
+        while self.is_alive():
+            pass
+
+    def is_aborted(self):
+        """Check if indexing was canceled or the plugin is unloading."""
+
+        return self.abort or unloading
+
+    def run(self):
+        """Thread loop."""
+
+        try:
+            files = list(project.find_files(self.folders, self.rules, self.is_aborted))
+            results = None
+            if not self.is_aborted():
+                results = project.index_files(
+                    files, self.workers, self.python, progress=self.progress, aborted=self.is_aborted, log=util.debug
+                )
+        except Exception:
+            print('ColorHelper: \n' + str(traceback.format_exc()))
+            self.status('Project color indexer failed!')
+            return
+        if results is None:
+            self.status('Project color indexer canceled...')
+            return
+        colors = project.merge_colors(results)
+        sublime.set_timeout(lambda colors=colors: self.update_index(colors), 0)
+        self.status('Project color index complete: %d colors in %d files...' % (len(colors), len(results)))
+
+
+class ChThread(ChScheduler):
+    """Schedule the auto popup on selection changes."""
+
+    main_thread = True
+
     def reset(self):
         """Reset the thread variables."""
 
-        self.wait_time = 0.12
-        self.time = time()
-        self.modified = False
-        self.ignore_all = False
-        self.abort = False
+        ChScheduler.reset(self)
         self.save_palettes = False
 
-    def color_okay(self, allowed_colors, color_type):
-        """Check if color is allowed."""
-
-        return color_type in allowed_colors
-
     def payload(self):
         """Code to run."""
 
-        self.modified = False
         self.ignore_all = True
         window = sublime.active_window()
         view = window.active_view()
         if view.settings().get('color_helper.no_auto', False):
             view.settings().set('color_helper.no_auto', False)
             self.ignore_all = False
-            self.time = time()
             return
         s = sublime.load_settings('color_helper.sublime-settings')
         auto_popup = s.get('auto_popup', True)
@@ -1720,67 +2612,13 @@ class ChThread(threading.Thread):
             )
 
             if scope_okay or insert_scope_okay:
-                allowed_colors = rules.get('allowed_colors', [])
-                point = sels[0].begin()
-                visible = view.visible_region()
-                start = point - 50
-                end = point + 50
-                if start < visible.begin():
-                    start = visible.begin()
-                if end > visible.end():
-                    end = visible.end()
-                bfr = view.substr(sublime.Region(start, end))
-                ref = point - start
-                for m in util.COLOR_ALL_RE.finditer(bfr):
-                    if ref >= m.start(0) and ref < m.end(0):
-                        if (
-                            (m.group('hexa_compressed') and self.color_okay(allowed_colors, 'hexa_compressed')) or
-                            (m.group('hex_compressed') and self.color_okay(allowed_colors, 'hex_compressed')) or
-                            (m.group('hexa') and self.color_okay(allowed_colors, 'hexa')) or
-                            (m.group('hex') and self.color_okay(allowed_colors, 'hex')) or
-                            (m.group('rgb') and self.color_okay(allowed_colors, 'rgb')) or
-                            (m.group('rgba') and self.color_okay(allowed_colors, 'rgba')) or
-                            (m.group('gray') and self.color_okay(allowed_colors, 'gray')) or
-                            (m.group('graya') and self.color_okay(allowed_colors, 'graya')) or
-                            (m.group('hsl') and self.color_okay(allowed_colors, 'hsl')) or
-                            (m.group('hsla') and self.color_okay(allowed_colors, 'hsla')) or
-                            (m.group('hwb') and self.color_okay(allowed_colors, 'hwb')) or
-                            (m.group('hwba') and self.color_okay(allowed_colors, 'hwba')) or
-                            (m.group('webcolors') and self.color_okay(allowed_colors, 'webcolors'))
-                        ):
-                            info = True
-                            execute = True
-                        break
-                    elif ref == m.end(0):
-                        if (
-                            (
-                                m.group('hash') and (
-                                    self.color_okay(allowed_colors, 'hex') or
-                                    self.color_okay(allowed_colors, 'hexa') or
-                                    self.color_okay(allowed_colors, 'hex_compressed') or
-                                    self.color_okay(allowed_colors, 'hexa_compressed')
-                                )
-                            ) or
-                            (m.group('rgb_open') and self.color_okay(allowed_colors, 'rgb')) or
-                            (m.group('rgba_open') and self.color_okay(allowed_colors, 'rgba')) or
-                            (m.group('hsl_open') and self.color_okay(allowed_colors, 'hsl')) or
-                            (m.group('hsla_open') and self.color_okay(allowed_colors, 'hsla')) or
-                            (
-                                m.group('hwb_open') and
-                                (
-                                    self.color_okay(allowed_colors, 'hwb') or
-                                    self.color_okay(allowed_colors, 'hwba')
-                                )
-                            ) or
-                            (
-                                m.group('gray_open') and (
-                                    self.color_okay(allowed_colors, 'gray') or
-                                    self.color_okay(allowed_colors, 'graya')
-                                )
-                            )
-                        ):
-                            execute = True
-                        break
+                found = get_color_at(view, sels[0].begin(), rules)[1]
+                if found is not None and not found.at_end:
+                    if found.complete:
+                        info = True
+                        execute = True
+                elif found is not None and not found.complete:
+                    execute = True
                 if execute:
                     view.run_command('color_helper', {"mode": "palette" if not info else "info", "auto": True})
             if (
@@ -1790,23 +2628,6 @@ class ChThread(threading.Thread):
             ):
                 mdpopups.hide_popup(view)
         self.ignore_all = False
-        self.time = time()
-
-    def kill(self):
-        """Kill thread."""
-
-        self.abort = True
-        while self.is_alive():
-            pass
-        self.reset()
-
-    def run(self):
-        """Thread loop."""
-
-        while not self.abort:
-            if self.modified is True and time() - self.time > self.wait_time:
-                sublime.set_timeout(lambda: self.payload(), 0)
-            sleep(0.5)
 
 
 ###########################
@@ -1818,6 +2639,8 @@ def settings_reload():
     global reload_flag
     reload_flag = True
     ch_last_updated = time()
+    if ch_thread is not None:
+        ch_thread.configure()
     setup_previews()
 
 
@@ -1834,14 +2657,15 @@ def setup_previews():
     for w in sublime.windows():
         for v in w.views():
             v.settings().clear_on_change('color_helper.reload')
-            v.settings().erase('color_helper.preview_meta')
             v.erase_phantoms('color_helper')
+    ch_preview_state.clear()
     unloading = False
 
     if ch_settings.get('inline_previews', False):
         ch_preview = ChPreview()
         ch_preview_thread = ChPreviewThread()
         ch_preview_thread.start()
+        ch_preview_thread.schedule()
 
 
 def plugin_loaded():
@@ -1878,6 +2702,8 @@ def plugin_unloaded():
         ch_thread.kill()
     if ch_file_thread is not None:
         ch_file_thread.kill()
+    if ch_project_thread is not None:
+        ch_project_thread.kill()
     if ch_preview_thread is not None:
         ch_preview_thread.kill()
 
@@ -10,6 +10,7 @@ import struct
 import re
 import sys
 from io import BytesIO
+from .rgba import clamp, convert_colors, pack_channels
 
 PY3 = sys.version_info >= (3, 0)
 
@@ -60,21 +61,6 @@ UNIT_SIZE = {
 RE_UNIT = re.compile(r'\s*(\d*)([cbB?hHiIlLqQfd])\s*')
 
 
-def split_channels(rgb):
-    """
-    Split an RGB color into channels.
-
-    Take a color of the format #RRGGBBAA (alpha optional and will be stripped)
-    and convert to a tuple with format (r, g, b).
-    """
-
-    return (
-        float(int(rgb[1:3], 16)) / 255.0,
-        float(int(rgb[3:5], 16)) / 255.0,
-        float(int(rgb[5:7], 16)) / 255.0
-    )
-
-
 def format_byte_size(fmt):
     """Determine the number of bytes form the fmt string."""
 
@@ -117,8 +103,8 @@ class _Writer(object):
         self.write('H', GROUP_END)
         self.write('i', 0)
 
-    def write_color(self, color, name=None):
-        """Write the RGB color entry."""
+    def write_color(self, rgb, name=None):
+        """Write the RGB color entry from the red, green, and blue channel bytes."""
 
         self.write('H', COLOR_ENTRY)
         if name is None:
@@ -127,7 +113,7 @@ class _Writer(object):
         self.write('H', len(name) + 1)
         self.write_string(name, double_byte=True)
 
-        r, g, b = split_channels(color)
+        r, g, b = [float(c) / 255.0 for c in rgb]
         self.write_string('RGB ')
         self.write('f', r)
         self.write('f', g)
@@ -225,16 +211,16 @@ class _Reader(object):
         return int(self.read('H')[0])
 
     def get_color(self):
-        """Get RGB color."""
+        """Get RGB color as a packed `0xRRGGBBAA` integer."""
 
         color_type = self.read_string(4)
         if 'RGB ' != color_type:
             raise Exception('Only RGB is supported at this time, not %s!' % color_type)
-        r = int(float(self.read('f')[0]) * 255.0)
-        g = int(float(self.read('f')[0]) * 255.0)
-        b = int(float(self.read('f')[0]) * 255.0)
+        r = clamp(int(float(self.read('f')[0]) * 255.0), 0, 255)
+        g = clamp(int(float(self.read('f')[0]) * 255.0), 0, 255)
+        b = clamp(int(float(self.read('f')[0]) * 255.0), 0, 255)
         self.read('H')
-        return "#%02x%02x%02x" % (r, g, b)
+        return pack_channels(r, g, b)
 
     def close(self):
         """Close the binary."""
@@ -267,6 +253,9 @@ class _Reader(object):
                     elif block == GROUP_END:
                         self.total_blocks -= 1
                         self.get_block_length()
+                        columns = convert_colors([c['color'] for c in palette['colors']], columns=('hex',))
+                        for color_entry, color in zip(palette['colors'], columns.hex):
+                            color_entry['color'] = color
                         yield palette
                     else:
                         raise Exception('Expected group end or color entry block!')
@@ -305,8 +294,9 @@ def dumps(ase, palettes):
 
         for p in palettes:
             binary.write_group_start(p["title"])
-            for c in p['colors']:
-                binary.write_color(c['color'], c.get('name'))
+            columns = convert_colors([c['color'] for c in p['colors']], columns=('rgb',))
+            for c, rgb in zip(p['colors'], columns.rgb):
+                binary.write_color(rgb, c.get('name'))
             binary.write_group_end()
         binary.bin.seek(0)
         text = binary.bin.read()
@@ -330,8 +320,9 @@ def dump(ase, palettes):
 
         for p in palettes:
             binary.write_group_start(p["title"])
-            for c in p['colors']:
-                binary.write_color(c['color'], c.get('name'))
+            columns = convert_colors([c['color'] for c in p['colors']], columns=('rgb',))
+            for c, rgb in zip(p['colors'], columns.rgb):
+                binary.write_color(rgb, c.get('name'))
             binary.write_group_end()
     except Exception:
         binary.close()
@@ -0,0 +1,14 @@
+"""
+ColorHelper color engine.
+
+Scanning, parsing, and conversion of colors on plain strings and offsets.
+Nothing in the engine depends on the Sublime Text API.
+"""
+from . import cache  # noqa: F401
+from . import patterns  # noqa: F401
+from . import translate  # noqa: F401
+from . import scanner  # noqa: F401
+from . import insert  # noqa: F401
+from . import convert  # noqa: F401
+from . import index  # noqa: F401
+from . import project  # noqa: F401
@@ -0,0 +1,96 @@
+"""
+ColorHelper engine caches.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread safe, size bounded, least recently used cache."""
+
+    def __init__(self, size):
+        """Initialize."""
+
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Get the cached value and mark it as recently used."""
+
+        with self.lock:
+            try:
+                value = self.cache[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache the value and evict the least recently used values if needed."""
+
+        with self.lock:
+            self.cache[key] = value
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+    def clear(self):
+        """Clear the cache and the counters."""
+
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get cache statistics for debug output."""
+
+        return 'hits: %d, misses: %d, entries: %d/%d' % (self.hits, self.misses, len(self.cache), self.size)
+
+
+class ByteLRUCache(LRUCache):
+    """Least recently used cache of strings bounded by entry count and total size in bytes."""
+
+    def __init__(self, size, max_bytes):
+        """Initialize."""
+
+        LRUCache.__init__(self, size)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+    def put(self, key, value):
+        """Cache the value and evict the least recently used values until it fits."""
+
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.cache.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.cache[key] = value
+            self.bytes += size
+            while len(self.cache) > self.size or self.bytes > self.max_bytes:
+                self.bytes -= len(self.cache.popitem(last=False)[1])
+
+    def clear(self):
+        """Clear the cache and the counters."""
+
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.bytes = 0
+
+    def stats(self):
+        """Get cache statistics for debug output."""
+
+        return '%s, bytes: %d/%d' % (LRUCache.stats(self), self.bytes, self.max_bytes)
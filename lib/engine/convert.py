@@ -0,0 +1,108 @@
+"""
+ColorHelper engine color format conversion.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+from ..rgba import RGBA, fmt_float, pack_hex, format_hex, convert_colors
+from .translate import compress_hex
+
+
+def to_rgb(color, alpha=None):
+    """Format `#rrggbb` as `rgb()`, or `rgba()` if an alpha is given."""
+
+    value = "%d, %d, %d" % (int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16))
+    if alpha:
+        value += ', %s' % alpha
+    return ("rgba(%s)" if alpha else "rgb(%s)") % value
+
+
+def to_gray(color, alpha=None):
+    """Format a gray `#rrggbb` as `gray()`."""
+
+    value = "%d" % int(color[1:3], 16)
+    if alpha:
+        value += ', %s' % alpha
+    return "gray(%s)" % value
+
+
+def get_hsl(color):
+    """Get the formatted hue, saturation, and lightness of `#rrggbb`."""
+
+    h, l, s = RGBA(color).tohls()
+    return fmt_float(h * 360.0), fmt_float(s * 100.0), fmt_float(l * 100.0)
+
+
+def get_hwb(color):
+    """Get the formatted hue, whiteness, and blackness of `#rrggbb`."""
+
+    h, w, b = RGBA(color).tohwb()
+    return fmt_float(h * 360.0), fmt_float(w * 100.0), fmt_float(b * 100.0)
+
+
+def to_hsl(color, alpha=None):
+    """Format `#rrggbb` as `hsl()`, or `hsla()` if an alpha is given."""
+
+    value = "%s, %s%%, %s%%" % get_hsl(color)
+    if alpha:
+        value += ', %s' % alpha
+    return ("hsla(%s)" if alpha else "hsl(%s)") % value
+
+
+def to_hwb(color, alpha=None):
+    """Format `#rrggbb` as `hwb()`."""
+
+    value = "%s, %s%%, %s%%" % get_hwb(color)
+    if alpha:
+        value += ', %s' % alpha
+    return "hwb(%s)" % value
+
+
+def to_hex(color, alpha_hex=None, argb=False, compress=False, upper=False):
+    """Format `#rrggbb` as hex with an optional alpha channel (first if `argb`)."""
+
+    if alpha_hex:
+        color = '#' + alpha_hex + color[1:] if argb else color + alpha_hex
+    if compress:
+        color = compress_hex(color)
+    return color.upper() if upper else color.lower()
+
+
+def pack_palette_color(color, precision=None):
+    """
+    Pack a palette color into an integer.
+
+    The color is packed as `0xRRGGBBAA` and shifted up a byte to make room
+    for the decimal precision of the alpha channel (`#rrggbbaa@precision`).
+    Packed colors sort just like the formatted strings.
+    """
+
+    return (pack_hex(color) << 8) | (precision or 0)
+
+
+def format_palette_color(value):
+    """Format a packed palette color as `#rrggbbaa` or `#rrggbbaa@precision`."""
+
+    if isinstance(value, str):
+        # Palettes saved before colors were packed.
+        return value
+    precision = value & 0xFF
+    color = format_hex(value >> 8)
+    return color + '@%d' % precision if precision else color
+
+
+def format_palette_colors(values):
+    """Format a list of packed palette colors (see `format_palette_color`) with one batch conversion."""
+
+    columns = convert_colors([value >> 8 for value in values if not isinstance(value, str)], columns=('hex', 'alpha'))
+    channels = zip(columns.hex, columns.alpha)
+    colors = []
+    for value in values:
+        if isinstance(value, str):
+            # Palettes saved before colors were packed.
+            colors.append(value)
+            continue
+        color, alpha = next(channels)
+        precision = value & 0xFF
+        colors.append('%s%02x@%d' % (color, alpha, precision) if precision else '%s%02x' % (color, alpha))
+    return colors
@@ -0,0 +1,293 @@
+"""
+ColorHelper engine file color index.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+import bisect
+import re
+from itertools import accumulate
+from .scanner import row_colors
+
+# Lines that can be entirely inside of a color function (numbers, separators, and white space),
+# and the ends of lines that open a color function.
+COLOR_CONTINUATION_RE = re.compile(r'^[\s\d.,%+\-]*$')
+COLOR_OPEN_RE = re.compile(r'\([\s\d.,%+\-]*$')
+
+
+def common_prefix(a, b):
+    """Get the length of the common prefix of two sequences (lists or strings)."""
+
+    lo = 0
+    hi = min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def scan_source(source, color_re, use_hex_argb=False, aborted=None):
+    """
+    Find the colors of the source by row.
+
+    The source is a list of the base row, the text, and the limit of each region (see `FileIndex.get_source`).
+    Returns a dictionary of rows and the set of packed palette colors in them, and a dictionary
+    of the rows and the last row their colors end on, or `None` if `aborted` returns true.
+    """
+
+    colors = {}
+    ends = {}
+    for base_row, text, limit in source:
+        if aborted is not None and aborted():
+            return None
+        for row, end_row, color in row_colors(text, base_row, color_re, use_hex_argb, limit, aborted):
+            colors.setdefault(row, set()).add(color)
+            if end_row > ends.get(row, row):
+                ends[row] = end_row
+        if aborted is not None and aborted():
+            return None
+    return colors, ends
+
+
+class FileIndex(object):
+    """
+    Persistent color index of a buffer.
+
+    Colors are recorded by the line they start on so that edits only require
+    the modified lines to be rescanned.  A reference count of every color is
+    kept along with a sorted palette that is adjusted as lines are added or
+    removed.  Colors in color functions can span lines, so the last row of
+    the colors that do is kept too.
+
+    A snapshot of the lines and scannable regions from the last scan is kept
+    so the dirty lines can be found by comparing it against the current buffer.
+    This catches edits anywhere in the file as well as scope changes that
+    don't alter the text (opening a comment, etc.).  Regions are given as
+    sorted `(begin, end)` offsets.
+    """
+
+    def __init__(self, allowed_colors, use_hex_argb):
+        """Setup the index."""
+
+        self.allowed_colors = set(allowed_colors)
+        self.use_hex_argb = bool(use_hex_argb)
+        self.rows = {}
+        self.ends = {}
+        self.counts = {}
+        self.palette = []
+        self.lines = []
+        self.offsets = []
+        self.regions = []
+        self.spans = []
+        self.span_ends = []
+        self.modified = False
+        self.rebuild = False
+
+    def is_compatible(self, allowed_colors, use_hex_argb):
+        """Check if the index was built with the given rules."""
+
+        return self.allowed_colors == set(allowed_colors) and self.use_hex_argb == bool(use_hex_argb)
+
+    def add_colors(self, colors):
+        """Reference the given colors and add new ones to the palette."""
+
+        for color in colors:
+            count = self.counts.get(color, 0)
+            if not count:
+                bisect.insort(self.palette, color)
+            self.counts[color] = count + 1
+
+    def remove_colors(self, colors):
+        """Dereference the given colors and remove unused ones from the palette."""
+
+        for color in colors:
+            count = self.counts[color] - 1
+            if count:
+                self.counts[color] = count
+            else:
+                del self.counts[color]
+                del self.palette[bisect.bisect_left(self.palette, color)]
+
+    def get_row(self, pt):
+        """Get the row of the given point in the current snapshot."""
+
+        return bisect.bisect_right(self.offsets, pt)
+
+    def get_row_spans(self, rows):
+        """Get the first and last row of each run of consecutive rows."""
+
+        spans = []
+        for row in sorted(rows):
+            if spans and spans[-1][1] == row - 1:
+                spans[-1][1] = row
+            else:
+                spans.append([row, row])
+        return spans
+
+    def get_open_row(self, row):
+        """
+        Get the row of a color function that may still be open at the start of the given row.
+
+        Lines that can be inside of a color function are skipped until a line that opens one.
+        If there is none, the given row is returned.
+        """
+
+        lines = self.lines
+        first = row
+        while first > 0 and COLOR_CONTINUATION_RE.match(lines[first - 1]):
+            first -= 1
+        if first > 0 and COLOR_OPEN_RE.search(lines[first - 1]):
+            return first - 1
+        return row
+
+    def query(self, begin, end):
+        """Get the scannable regions of the snapshot that intersect the given range."""
+
+        spans = self.spans
+        count = len(spans)
+        index = bisect.bisect_left(self.span_ends, begin)
+        found = []
+        while index < count and spans[index][0] <= end:
+            found.append(spans[index])
+            index += 1
+        return found
+
+    def snapshot(self, text, regions):
+        """
+        Replace the snapshot with the given buffer text and scannable regions.
+
+        Returns the regions in row/column form so they can be compared with the old snapshot.
+        """
+
+        self.lines = text.split('\n')
+        self.offsets = list(accumulate(len(line) + 1 for line in self.lines))
+        self.spans = list(regions)
+        self.span_ends = list(accumulate((end for begin, end in self.spans), max))
+        get_row = self.get_row
+        old_regions = self.regions
+        self.regions = []
+        for begin, end in self.spans:
+            begin_row = get_row(begin)
+            end_row = get_row(end)
+            self.regions.append(
+                (
+                    begin_row, begin - (self.offsets[begin_row - 1] if begin_row else 0),
+                    end_row, end - (self.offsets[end_row - 1] if end_row else 0)
+                )
+            )
+        return old_regions
+
+    def invalidate(self, text, regions):
+        """
+        Update the snapshot and invalidate the rows that differ from the last scan.
+
+        The colors of the invalidated rows are dropped, the rows after them are shifted
+        to their new positions, and the invalidated rows (in the new snapshot) are returned.
+        """
+
+        old_lines = self.lines
+        old_regions = self.snapshot(text, regions)
+        new_lines = self.lines
+
+        # Find the lines that were changed
+        prefix = common_prefix(old_lines, new_lines)
+        suffix = common_prefix(old_lines[prefix:][::-1], new_lines[prefix:][::-1])
+        delta = len(new_lines) - len(old_lines)
+        old_end = len(old_lines) - suffix
+        first = prefix
+        last = len(new_lines) - suffix - 1
+
+        # Find scannable regions that changed outside of the changed lines
+        shifted = [
+            (
+                br + delta if br >= old_end else br, bc,
+                er + delta if er >= old_end else er, ec
+            ) for br, bc, er, ec in old_regions
+        ]
+        prefix = common_prefix(shifted, self.regions)
+        suffix = common_prefix(shifted[prefix:][::-1], self.regions[prefix:][::-1])
+        changed = shifted[prefix:len(shifted) - suffix] + self.regions[prefix:len(self.regions) - suffix]
+        if changed:
+            first = min([first] + [r[0] for r in changed])
+            last = max([last] + [r[2] for r in changed])
+
+        if first > last and not delta:
+            return set()
+
+        # Include a line of context on either side to catch colors that are joined or split.
+        first = max(first - 1, 0)
+        last = min(last + 1, len(new_lines) - 1)
+        old_last = last - delta
+
+        # Include the lines of colors that run into the changed lines: the old colors
+        # by the rows they end on, and new ones by the color functions still open above them.
+        for row, end in self.ends.items():
+            if row < first <= end:
+                first = row
+        first = self.get_open_row(first)
+        extended = True
+        while extended:
+            extended = False
+            for row, end in self.ends.items():
+                if first <= row <= old_last < end:
+                    old_last = end
+                    extended = True
+        last = old_last + delta
+
+        for row in [r for r in self.rows if first <= r <= old_last]:
+            self.remove_colors(self.rows.pop(row))
+            self.ends.pop(row, None)
+        if delta:
+            self.rows = {(r + delta if r > old_last else r): c for r, c in self.rows.items()}
+            self.ends = {
+                (r + delta if r > old_last else r): (e + delta if e > old_last else e) for r, e in self.ends.items()
+            }
+        return set(range(first, last + 1))
+
+    def get_source(self, text, rows=None):
+        """
+        Get the text of the scannable regions to search for the given rows (or all rows).
+
+        Returns the base row, the text, and the limit of each region.  The text of the rows
+        is not cut at the last row, as colors that start on it can run past it, so the limit
+        is the offset in the text after which colors no longer start on the given rows.
+        """
+
+        get_row = self.get_row
+        if rows is None:
+            return [(get_row(begin), text[begin:end], None) for begin, end in self.spans]
+
+        source = []
+        for first, last in self.get_row_spans(rows):
+            begin = self.offsets[first - 1] if first else 0
+            end = self.offsets[last] - 1
+            for region_begin, region_end in self.query(begin, end):
+                start = max(region_begin, begin)
+                source.append((get_row(start), text[start:region_end], min(region_end, end) - start))
+        return source
+
+    def update_rows(self, rows, found, ends):
+        """
+        Replace the colors on the given rows with the colors that were found.
+
+        The rows that the found colors run over are replaced too.
+        If `rows` is `None`, the found colors replace the entire index.
+        """
+
+        if rows is None:
+            rows = list(self.rows.keys())
+        rows = set(rows)
+        for row, end in ends.items():
+            rows.update(range(row, end + 1))
+        for row in rows:
+            colors = self.rows.pop(row, None)
+            if colors:
+                self.remove_colors(colors)
+            self.ends.pop(row, None)
+        for row, colors in found.items():
+            self.rows[row] = colors
+            self.add_colors(colors)
+        self.ends.update(ends)
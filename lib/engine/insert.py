@@ -0,0 +1,182 @@
+"""
+ColorHelper engine insert calculation.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+from .. import csscolors
+from .patterns import COLOR_TYPES, INCOMPLETE_TYPES, get_color_re
+from .translate import translate_color
+from .scanner import color_at
+from . import convert as conv
+
+
+class InsertCalc(object):
+    """
+    Calculate where and how a color is inserted.
+
+    `text` is the text around `point` starting at buffer offset `start`, and `next_char`
+    is the character at `point`.  The result is the `span` to replace.
+    """
+
+    def __init__(self, text, start, point, target_color, convert, allowed_colors, use_hex_argb, next_char=''):
+        """Initialize."""
+
+        self.convert_rgb = False
+        self.convert_hsl = False
+        self.convert_hwb = False
+        self.convert_gray = False
+        self.allowed_colors = allowed_colors
+        self.alpha = None
+        self.force_alpha = False
+        self.use_hex_argb = use_hex_argb
+        self.alpha_hex = None
+        self.text = text
+        self.next_char = next_char
+        self.start = start
+        self.point = point
+        self.span = (point, point)
+
+        self.web_color = None
+        self.color = target_color[:-2] if len(target_color) > 7 else target_color
+
+        if convert == "name":
+            try:
+                if len(target_color) > 7:
+                    target_color = target_color[:-2]
+                self.web_color = csscolors.hex2name(target_color)
+            except Exception:
+                pass
+            self.force_alpha = False
+        elif convert in ('gray', 'graya'):
+            self.convert_gray = True
+            self.force_alpha = convert == 'graya'
+        elif convert in ('hex', 'hexa', 'ahex'):
+            self.force_alpha = convert in ('hexa', 'ahex')
+        elif convert in ('rgb', 'rgba'):
+            self.convert_rgb = True
+            self.force_alpha = convert == 'rgba'
+        elif convert in ('hsl', 'hsla'):
+            self.convert_hsl = True
+            self.force_alpha = convert == 'hsla'
+        elif convert in ('hwb', 'hwba'):
+            self.convert_hwb = True
+            self.force_alpha = convert == 'hwba'
+
+    def replacement(self, m):
+        """See if match is a convert replacement of an existing color."""
+
+        found = m.lastgroup in COLOR_TYPES
+        if found:
+            self.span = (m.start(0) + self.start, m.end(0) + self.start)
+            color, alpha, alpha_dec = translate_color(m, self.use_hex_argb)
+            if alpha is not None:
+                self.alpha_hex = alpha.lower()
+                self.alpha = alpha_dec
+        return found
+
+    def completion(self, m):
+        """See if match is completing an color."""
+
+        color_type = m.lastgroup
+        found = color_type in INCOMPLETE_TYPES
+        if found:
+            offset = 0 if color_type == 'hash' or self.next_char != ')' else 1
+            self.span = (m.start(0) + self.start, m.end(0) + self.start + offset)
+            if color_type in ('rgba_open', 'hsla_open'):
+                self.alpha = '1'
+                self.alpha_hex = 'ff'
+        return found
+
+    def convert_alpha(self):
+        """Setup conversion alpha."""
+
+        if self.force_alpha and self.alpha is None:
+            self.alpha = '1'
+            self.alpha_hex = 'ff'
+        elif not self.force_alpha:
+            self.alpha = None
+            self.alpha_hex = None
+
+    def calc(self, color=None):
+        """
+        Calculate how we are to insert the target color.
+
+        `color` is the `ColorAt` of the point if it was already looked up.
+        """
+
+        found = False
+        if color is None:
+            color = color_at(
+                self.text, self.point - self.start, get_color_re(self.allowed_colors, incomplete=True), touching=True
+            )
+        if color is not None:
+            found = self.completion(color.match) if color.at_end else self.replacement(color.match)
+
+        self.convert_alpha()
+
+        return found
+
+    def get_value(self, convert, compress_hex=False, upper=False):
+        """Get the text to insert."""
+
+        if self.web_color and not self.alpha:
+            value = self.web_color
+        elif self.convert_rgb:
+            value = conv.to_rgb(self.color, self.alpha)
+        elif self.convert_gray:
+            value = conv.to_gray(self.color, self.alpha)
+        elif self.convert_hsl:
+            value = conv.to_hsl(self.color, self.alpha)
+        elif self.convert_hwb:
+            value = conv.to_hwb(self.color, self.alpha)
+        else:
+            value = conv.to_hex(self.color, self.alpha_hex, convert == 'ahex', compress_hex, upper)
+        return value
+
+
+class PickerInsertCalc(object):
+    """Calculate where a picked color is inserted."""
+
+    def __init__(self, text, start, point, allowed_colors, next_char=''):
+        """Initialize insertion object."""
+
+        self.text = text
+        self.next_char = next_char
+        self.span = (point, point)
+        self.allowed_colors = allowed_colors
+        self.start = start
+        self.point = point
+
+    def replacement(self, m):
+        """See if match is a replacement of an existing color."""
+
+        found = m.lastgroup in COLOR_TYPES
+        if found:
+            self.span = (m.start(0) + self.start, m.end(0) + self.start)
+        return found
+
+    def completion(self, m):
+        """See if match is completing an color."""
+
+        color_type = m.lastgroup
+        found = color_type in INCOMPLETE_TYPES
+        if found:
+            offset = 0 if color_type == 'hash' or self.next_char != ')' else 1
+            self.span = (m.start(0) + self.start, m.end(0) + self.start + offset)
+        return found
+
+    def calc(self, color=None):
+        """
+        Calculate how we are to insert the target color.
+
+        `color` is the `ColorAt` of the point if it was already looked up.
+        """
+
+        if color is None:
+            color = color_at(
+                self.text, self.point - self.start, get_color_re(self.allowed_colors, incomplete=True), touching=True
+            )
+        if color is None:
+            return False
+        return self.completion(color.match) if color.at_end else self.replacement(color.match)
@@ -0,0 +1,217 @@
+"""
+ColorHelper engine color patterns.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+import re
+from .. import csscolors
+
+
+def trie_pattern(words):
+    """
+    Get a pattern that matches any of the words, with the alternatives nested as a trie.
+
+    At each character only the branches that continue with that character are tried,
+    instead of every word.
+    """
+
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = None
+
+    def build(node):
+        """Build the pattern of a trie node."""
+
+        alternatives = [re.escape(c) + build(child) for c, child in sorted(node.items()) if c]
+        if not alternatives:
+            return ''
+        pattern = alternatives[0] if len(alternatives) == 1 else '(?:%s)' % '|'.join(alternatives)
+        return '(?:%s)?' % pattern if '' in node else pattern
+
+    return build(trie)
+
+
+COLOR_PARTS = {
+    "percent": r"[+\-]?(?:(?:\d*\.\d+)|\d+)%",
+    "float": r"[+\-]?(?:(?:\d*\.\d+)|\d+)"
+}
+
+COLOR_PATTERNS = (
+    ('hexa', r'(?P<hexa>\#(?P<hexa_content>[\dA-Fa-f]{8}))\b'),
+    ('hex', r'(?P<hex>\#(?P<hex_content>[\dA-Fa-f]{6}))\b'),
+    ('hexa_compressed', r'(?P<hexa_compressed>\#(?P<hexa_compressed_content>[\dA-Fa-f]{4}))\b'),
+    ('hex_compressed', r'(?P<hex_compressed>\#(?P<hex_compressed_content>[\dA-Fa-f]{3}))\b'),
+    (
+        'rgb',
+        r'\b(?P<rgb>rgb\(\s*(?P<rgb_content>(?:%(float)s\s*,\s*){2}%(float)s | '
+        r'(?:%(percent)s\s*,\s*){2}%(percent)s)\s*\))'
+    ),
+    (
+        'rgba',
+        r'''\b(?P<rgba>rgba\(\s*(?P<rgba_content>
+        (?:%(float)s\s*,\s*){3}(?:%(percent)s|%(float)s) | (?:%(percent)s\s*,\s*){3}(?:%(percent)s|%(float)s)
+        )\s*\))'''
+    ),
+    ('hsl', r'\b(?P<hsl>hsl\(\s*(?P<hsl_content>%(float)s\s*,\s*%(percent)s\s*,\s*%(percent)s)\s*\))'),
+    (
+        'hsla',
+        r'\b(?P<hsla>hsla\(\s*(?P<hsla_content>%(float)s\s*,\s*(?:%(percent)s\s*,\s*){2}'
+        r'(?:%(percent)s|%(float)s))\s*\))'
+    ),
+    ('hwb', r'\b(?P<hwb>hwb\(\s*(?P<hwb_content>%(float)s\s*,\s*%(percent)s\s*,\s*%(percent)s)\s*\))'),
+    (
+        'hwba',
+        r'\b(?P<hwba>hwb\(\s*(?P<hwba_content>%(float)s\s*,\s*(?:%(percent)s\s*,\s*){2}'
+        r'(?:%(percent)s|%(float)s))\s*\))'
+    ),
+    ('gray', r'\b(?P<gray>gray\(\s*(?P<gray_content>%(float)s|%(percent)s)\s*\))'),
+    (
+        'graya',
+        r'\b(?P<graya>gray\(\s*(?P<graya_content>(?:%(float)s|%(percent)s)\s*,\s*(?:%(percent)s|%(float)s))\s*\))'
+    )
+)
+
+# Incomplete colors and the color types they can be completed to.
+INCOMPLETE_PATTERNS = (
+    ('hash', r'(?P<hash>\#)', ('hex', 'hexa', 'hex_compressed', 'hexa_compressed')),
+    ('rgb_open', r'\b(?P<rgb_open>rgb\()', ('rgb',)),
+    ('rgba_open', r'\b(?P<rgba_open>rgba\()', ('rgba',)),
+    ('hsl_open', r'\b(?P<hsl_open>hsl\()', ('hsl',)),
+    ('hsla_open', r'\b(?P<hsla_open>hsla\()', ('hsla',)),
+    ('hwb_open', r'\b(?P<hwb_open>hwb\()', ('hwb', 'hwba')),
+    ('gray_open', r'\b(?P<gray_open>gray\()', ('gray', 'graya'))
+)
+
+COMPLETE = ' |\n'.join([pattern for name, pattern in COLOR_PATTERNS]) % COLOR_PARTS
+
+# Color names are matched with a trie built once at import.  A flat alternation of the
+# 148 names is tried name by name at every position.
+COLOR_NAMES_TRIE = trie_pattern(sorted(set(name.lower() for name in csscolors.name2hex_map.keys())))
+
+COLOR_NAMES = r'\b(?P<webcolors>%s)\b(?!\()' % COLOR_NAMES_TRIE
+
+COLOR_TYPES = frozenset([name for name, pattern in COLOR_PATTERNS] + ['webcolors'])
+INCOMPLETE_TYPES = frozenset([name for name, pattern, types in INCOMPLETE_PATTERNS])
+
+HEX_IS_GRAY_RE = re.compile(r'(?i)^#([0-9a-f]{2})\1\1')
+HEX_COMPRESS_RE = re.compile(r'(?i)^#([0-9a-f])\1([0-9a-f])\2([0-9a-f])\3(?:([0-9a-f])\4)?$')
+
+INDEX_ALL_RE = re.compile((r'(?x)(?i)(?<![@#$.\-_])(?:%s|%s)(?![@#$.\-_])' % (COMPLETE, COLOR_NAMES)).encode('utf-8'))
+
+# Literals that the matches of each color type start with.  The literals are searched first
+# to find candidate positions, and the full color pattern is only tried at those positions.
+TYPE_LITERALS = {
+    "hex": r"\#",
+    "hexa": r"\#",
+    "hex_compressed": r"\#",
+    "hexa_compressed": r"\#",
+    "hash": r"\#",
+    "rgb": r"\brgb",
+    "rgba": r"\brgb",
+    "rgb_open": r"\brgb",
+    "rgba_open": r"\brgb",
+    "hsl": r"\bhsl",
+    "hsla": r"\bhsl",
+    "hsl_open": r"\bhsl",
+    "hsla_open": r"\bhsl",
+    "hwb": r"\bhwb",
+    "hwba": r"\bhwb",
+    "hwb_open": r"\bhwb",
+    "gray": r"\bgray",
+    "graya": r"\bgray",
+    "gray_open": r"\bgray"
+}
+
+color_re_cache = {}
+
+CSS3 = ("webcolors", "hex", "hex_compressed", "rgb", "rgba", "hsl", "hsla")
+CSS4 = CSS3 + ("gray", "graya", "hwb", "hwba", "hexa", "hexa_compressed")
+ALL = CSS4
+
+
+class ColorPattern(object):
+    """
+    Color regex that is only tried where a cheap literal prefilter finds a candidate.
+
+    Candidates are the positions of `#`, `rgb`, `hsl`, `hwb`, `gray`, and color names.
+    The results are the same as searching with the regex itself.
+    """
+
+    def __init__(self, regex, prefilter):
+        """Initialize."""
+
+        self.regex = regex
+        self.prefilter = prefilter
+        self.pattern = regex.pattern
+
+    def finditer(self, string, pos=0, endpos=None):
+        """Iterate the non-overlapping color matches."""
+
+        if endpos is None:
+            endpos = len(string)
+        match = self.regex.match
+        last = pos
+        for candidate in self.prefilter.finditer(string, pos, endpos):
+            start = candidate.start(0)
+            if start < last:
+                continue
+            m = match(string, start, endpos)
+            if m is not None:
+                last = m.end(0)
+                yield m
+
+    def search(self, string, pos=0, endpos=None):
+        """Find the first color match."""
+
+        for m in self.finditer(string, pos, endpos):
+            return m
+        return None
+
+    def match(self, string, pos=0, endpos=None):
+        """Match a color at the position."""
+
+        return self.regex.match(string, pos, len(string) if endpos is None else endpos)
+
+
+def get_color_re(allowed_colors, incomplete=False):
+    """
+    Get a compiled color regex that only contains the allowed color formats.
+
+    Formats that are not allowed are left out of the pattern entirely so they are
+    never matched.  If `incomplete` is enabled, patterns for incomplete colors that
+    can be completed to an allowed color are included as well.  The compiled patterns
+    are cached by allowed color set.
+    """
+
+    allowed = frozenset(allowed_colors)
+    key = (allowed, incomplete)
+    pattern = color_re_cache.get(key)
+    if pattern is None:
+        alternatives = [p % COLOR_PARTS for name, p in COLOR_PATTERNS if name in allowed]
+        literals = [TYPE_LITERALS[name] for name, p in COLOR_PATTERNS if name in allowed]
+        if 'webcolors' in allowed:
+            alternatives.append(COLOR_NAMES)
+            literals.append(r'\b' + COLOR_NAMES_TRIE)
+        if incomplete:
+            for name, p, types in INCOMPLETE_PATTERNS:
+                if allowed.intersection(types):
+                    alternatives.append(p)
+                    literals.append(TYPE_LITERALS[name])
+        if alternatives:
+            pattern = ColorPattern(
+                re.compile(r'(?x)(?i)(?<![@#$.\-_])(?:%s)(?![@#$.\-_])' % ' |\n'.join(alternatives)),
+                re.compile(r'(?i)%s' % '|'.join(sorted(set(literals))))
+            )
+        else:
+            never = re.compile(r'(?!)')
+            pattern = ColorPattern(never, never)
+        color_re_cache[key] = pattern
+    return pattern
+
+
+COLOR_RE = get_color_re(ALL)
+COLOR_ALL_RE = get_color_re(ALL, incomplete=True)
@@ -0,0 +1,357 @@
+"""
+ColorHelper engine project color index.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+import fnmatch
+import json
+import os
+import sys
+from .patterns import CSS3, CSS4, ALL
+from .scanner import get_scanner, index_colors
+
+# Folders that are never indexed (the Sublime Text defaults).
+FOLDER_EXCLUDE_PATTERNS = ('.svn', '.git', '.hg', 'CVS')
+
+# Files larger than this are skipped unless the rules say otherwise.
+MAX_FILE_SIZE = 2097152
+
+COLOR_SETS = {
+    "css3": CSS3,
+    "css4": CSS4,
+    "all": ALL
+}
+
+
+def get_allowed_colors(names):
+    """Get the set of color formats, expanding the `css3`, `css4`, and `all` sets."""
+
+    allowed_colors = set()
+    for name in names:
+        allowed_colors.update(COLOR_SETS.get(name, (name,)))
+    return allowed_colors
+
+
+def get_base_extensions(rule):
+    """
+    Get the extensions named by the base scopes of a rule.
+
+    Without a view, the base scopes can't be scored, so `source.scss` is taken to mean `.scss` files.
+    """
+
+    return ['.' + scope.strip().split('.')[-1].lower() for scope in rule.get("base_scopes", []) if scope.strip()]
+
+
+def get_file_rules(path, rules):
+    """
+    Get the scan rules of a file from the `color_scanning` rules.
+
+    Rules are matched by extension: a rule applies if the file extension is in its `extensions`,
+    or, if it has none, is named by one of its base scopes.  Returns `None` if no rule applies.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+    matched = False
+    allowed_colors = set()
+    use_hex_argb = False
+    max_file_size = None
+    for rule in rules:
+        extensions = [e.lower() for e in rule.get("extensions", [])] or get_base_extensions(rule)
+        if not ext or ext not in extensions or not rule.get("scan_scopes", []):
+            continue
+        matched = True
+        allowed_colors |= get_allowed_colors(rule.get("allowed_colors", []))
+        if rule.get("use_hex_argb", False):
+            use_hex_argb = True
+        value = rule.get("max_file_size")
+        if value is not None:
+            max_file_size = value if max_file_size is None else min(max_file_size, value)
+    if not matched:
+        return None
+    return {
+        "allowed_colors": allowed_colors,
+        "use_hex_argb": use_hex_argb,
+        "max_file_size": MAX_FILE_SIZE if max_file_size is None else max_file_size
+    }
+
+
+def excluded(name, patterns):
+    """Check if the name matches one of the patterns."""
+
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def find_files(folders, rules, aborted=None):
+    """
+    Find the files in the project folders that have scan rules.
+
+    Folders are given as in the project data, with optional `folder_exclude_patterns`
+    and `file_exclude_patterns`.  Yields the path, allowed colors, and hex ARGB option of each file.
+    """
+
+    seen = set()
+    for folder in folders:
+        root = folder.get('path')
+        if not root or not os.path.isdir(root):
+            continue
+        folder_excludes = list(FOLDER_EXCLUDE_PATTERNS) + folder.get('folder_exclude_patterns', [])
+        file_excludes = folder.get('file_exclude_patterns', [])
+        for base, dirs, files in os.walk(root, followlinks=folder.get('follow_symlinks', False)):
+            if aborted is not None and aborted():
+                return
+            dirs[:] = sorted(d for d in dirs if not excluded(d, folder_excludes))
+            for name in sorted(files):
+                if excluded(name, file_excludes):
+                    continue
+                path = os.path.join(base, name)
+                file_rules = get_file_rules(path, rules)
+                if file_rules is None or path in seen:
+                    continue
+                seen.add(path)
+                try:
+                    if os.path.getsize(path) > file_rules['max_file_size']:
+                        continue
+                except OSError:
+                    continue
+                yield path, sorted(file_rules['allowed_colors']), file_rules['use_hex_argb']
+
+
+def scan_file(path, allowed_colors, use_hex_argb=False):
+    """
+    Get the packed palette colors of a file.
+
+    This runs in the worker processes, so it only takes and returns plain values.
+    """
+
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+    except (OSError, IOError):
+        return []
+    colors = set()
+    for found in index_colors([(0, text)], get_scanner(allowed_colors).color_re, use_hex_argb).values():
+        colors |= found
+    return sorted(colors)
+
+
+def is_python(executable):
+    """Check if the executable is a Python interpreter (the Sublime Text plugin host is not)."""
+
+    return os.path.basename(executable or '').lower().startswith('python')
+
+
+def find_python(python=None):
+    """
+    Find the Python interpreter to start worker processes with.
+
+    This is the given interpreter, or the current one if it is a standalone interpreter.
+    No other interpreter is ever picked up, so workers are only started when asked for.
+    Returns `None` if there is none (as in the Sublime Text plugin host).
+    """
+
+    if python:
+        return python
+    if is_python(sys.executable):
+        return sys.executable
+    return None
+
+
+def get_import_root():
+    """
+    Get the folder this module is imported from, so worker processes can import it.
+
+    Returns `None` if the module is not a file on disk (as in a zipped `.sublime-package`).
+    """
+
+    if not os.path.isfile(__file__):
+        return None
+    root = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(__name__.count('.')):
+        root = os.path.dirname(root)
+    return root
+
+
+def get_workers(workers=None):
+    """Get the number of worker processes (one per CPU by default)."""
+
+    if workers:
+        return workers
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def start_worker(python, root, errors):
+    """Start a worker process that runs `main` with the Python interpreter, writing its errors to a file."""
+
+    import subprocess
+
+    startupinfo = None
+    if os.name == 'nt':
+        # Don't open a console window for the worker.
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return subprocess.Popen(
+        [python, '-E', '-m', __name__], cwd=root, startupinfo=startupinfo,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors
+    )
+
+
+def run_worker(process, files, found, errors):
+    """
+    Send the files to the worker process and queue the colors of each file as it is read back.
+
+    Returns the error of the worker if it failed, else `None`.
+    """
+
+    error = None
+    try:
+        process.stdin.write(json.dumps(files).encode('utf-8'))
+        process.stdin.close()
+        for line in process.stdout:
+            path, colors = json.loads(line.decode('utf-8'))
+            found.put((path, colors))
+    except (OSError, IOError, ValueError) as e:
+        error = str(e)
+    finally:
+        process.stdout.close()
+        process.wait()
+    if process.returncode or error:
+        errors.seek(0)
+        return 'exit code %s: %s' % (process.returncode, errors.read().decode('utf-8', 'replace').strip() or error)
+    return None
+
+
+def index_processes(files, results, total, workers, python, progress, aborted, log, poll):
+    """
+    Scan the files in worker processes, returns `False` if aborted.
+
+    The files are split between the workers, each a Python interpreter (see `find_python`)
+    running `main`, and the results are read back by a thread per worker, so the
+    scanning runs in parallel, outside of the current interpreter.  If processes
+    can't be started, or a worker fails, the files it didn't scan are left out of the results
+    and the reason is passed to `log`.
+    """
+
+    python = find_python(python)
+    if python is None:
+        log('Project index workers not started: no Python interpreter is set')
+        return True
+    root = get_import_root()
+    if root is None:
+        log('Project index workers not started: the package is not unpacked')
+        return True
+    try:
+        import queue
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError as e:
+        log('Project index workers not started: %s' % e)
+        return True
+
+    workers = min(get_workers(workers), len(files))
+    processes = []
+    readers = []
+    found = queue.Queue()
+    canceled = False
+    with ThreadPoolExecutor(workers) as pool:
+        try:
+            for index in range(workers):
+                errors = tempfile.TemporaryFile()
+                try:
+                    process = start_worker(python, root, errors)
+                except Exception:
+                    errors.close()
+                    raise
+                processes.append((process, errors))
+                readers.append(
+                    pool.submit(run_worker, process, [list(f) for f in files[index::workers]], found, errors)
+                )
+        except (OSError, ValueError) as e:
+            log('Project index worker could not be started with %s: %s' % (python, e))
+        while True:
+            if aborted is not None and aborted():
+                for process, errors in processes:
+                    process.kill()
+                canceled = True
+                break
+            try:
+                path, colors = found.get(timeout=poll)
+            except queue.Empty:
+                # A reader is only done once its worker has exited and all of its results are queued.
+                if all(reader.done() for reader in readers) and found.empty():
+                    break
+                continue
+            results[path] = colors
+            if progress is not None:
+                progress(len(results), total, False)
+    for process, errors in processes:
+        errors.close()
+    if canceled:
+        return False
+    for reader in readers:
+        error = reader.result()
+        if error is not None:
+            log('Project index worker failed with %s' % error)
+    return True
+
+
+def index_files(files, workers=None, python=None, progress=None, aborted=None, log=None, poll=0.1):
+    """
+    Scan the files and get the colors of each file.
+
+    `files` are the path, allowed colors, and hex ARGB option of each file.
+    Files are scanned in parallel in worker processes (see `index_processes`) unless
+    `workers` is `1`.  Files that weren't scanned by a worker, as when workers can't be
+    started, are scanned one by one in the calling thread as a fallback.  `progress` is called
+    with the number of files done, the total, and whether the files are scanned by the fallback.
+    `aborted` is polled while scanning, and `log` is called with the reason workers failed.
+    Returns a dictionary of paths and their packed colors, or `None` if aborted.
+    """
+
+    files = list(files)
+    total = len(files)
+    results = {}
+    fallback = False
+    if workers != 1 and total > 1:
+        fallback = True
+        if not index_processes(
+            files, results, total, workers, python, progress, aborted, log or (lambda message: None), poll
+        ):
+            return None
+    for f in files:
+        if f[0] in results:
+            continue
+        if aborted is not None and aborted():
+            return None
+        results[f[0]] = scan_file(*f)
+        if progress is not None:
+            progress(len(results), total, fallback)
+    return results
+
+
+def merge_colors(results):
+    """Get the sorted palette of all the colors found in the files."""
+
+    colors = set()
+    for found in results.values():
+        colors.update(found)
+    return sorted(colors)
+
+
+def main():
+    """Scan the files read as JSON from stdin, and write the path and colors of each file as a line of JSON."""
+
+    for path, allowed_colors, use_hex_argb in json.loads(sys.stdin.read()):
+        sys.stdout.write(json.dumps([path, scan_file(path, allowed_colors, use_hex_argb)]) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+ColorHelper engine color scanner.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+from .patterns import COLOR_RE, COLOR_TYPES, get_color_re
+from .translate import translate_color, color_match
+from .convert import pack_palette_color
+
+scanner_cache = {}
+
+
+class ColorScanner(object):
+    """
+    Color regexes specialized to a set of allowed color formats.
+
+    Formats that are not allowed are left out of the regexes, so they are never matched.
+    """
+
+    def __init__(self, allowed_colors):
+        """Initialize."""
+
+        self.allowed_colors = frozenset(allowed_colors)
+        self.color_re = get_color_re(self.allowed_colors)
+        self.incomplete_re = get_color_re(self.allowed_colors, incomplete=True)
+
+
+def get_scanner(allowed_colors):
+    """Get the scanner of the allowed color formats, shared by all equal sets of formats."""
+
+    key = frozenset(allowed_colors)
+    scanner = scanner_cache.get(key)
+    if scanner is None:
+        scanner = ColorScanner(key)
+        scanner_cache[key] = scanner
+    return scanner
+
+
+def find_colors(text, offset, color_re, begin=None, end=None):
+    """
+    Find the colors in the text, where `offset` is the position of the text in the buffer.
+
+    Yields the buffer start and end of each color (within `begin` and `end` if given) and its match.
+    """
+
+    for m in color_re.finditer(text):
+        start = offset + m.start(0)
+        stop = offset + m.end(0)
+        if (begin is None or start >= begin) and (end is None or stop <= end):
+            yield start, stop, m
+
+
+class ColorAt(object):
+    """
+    The color at an index of the text.
+
+    `span` is the span of the color in the text, `complete` is whether it is a complete color
+    (rather than an incomplete one that can be completed), and `at_end` is whether the index
+    is at the end of the color instead of inside it.
+    """
+
+    __slots__ = ('match', 'color_type', 'span', 'complete', 'at_end')
+
+    def __init__(self, match, ref):
+        """Initialize."""
+
+        self.match = match
+        self.color_type = match.lastgroup
+        self.span = match.span(0)
+        self.complete = self.color_type in COLOR_TYPES
+        self.at_end = ref == self.span[1]
+
+
+def is_word_char(c):
+    """Check if the character is a word character."""
+
+    return c.isalnum() or c == '_'
+
+
+def color_at(text, ref, color_re, touching=False):
+    """
+    Get the color at the index `ref` of the text.
+
+    Instead of searching the text from the start, the positions a color can start at
+    (`#` or the start of a word) are found by scanning backward from `ref`, and the
+    color pattern is only matched, anchored, at those positions, nearest first.
+    If `touching` is enabled, a color that ends at `ref` is found too (so incomplete colors can be completed).
+    Returns a `ColorAt` or `None` if there is no color at `ref`.
+    """
+
+    match = color_re.match
+    for start in range(min(ref, len(text) - 1), -1, -1):
+        c = text[start]
+        if c == '#' or (is_word_char(c) and (start == 0 or not is_word_char(text[start - 1]))):
+            m = match(text, start)
+            if m is not None and (ref < m.end(0) or (touching and ref == m.end(0))):
+                return ColorAt(m, ref)
+        elif start < ref and not (is_word_char(c) or c.isspace() or c in ',.%+-()'):
+            # Colors only contain words, numbers, white space, and the punctuation of color functions.
+            break
+    return None
+
+
+def validate_color(text, offset, color_start, length, color_type, use_hex_argb=False):
+    """
+    Check that a color is still at `color_start` in the text around it.
+
+    The color must be the first color in the text (at buffer `offset`) with the same type and length.
+    Returns the normalized color (`#rrggbbaa`) or `None` if the color is gone.
+    """
+
+    m = COLOR_RE.search(text)
+    if (
+        m and m.group(color_type) and
+        offset + m.start(0) == color_start and
+        m.end(0) - m.start(0) == length
+    ):
+        return color_match(m, use_hex_argb)[2]
+    return None
+
+
+def row_colors(text, base_row, color_re, use_hex_argb=False, limit=None, aborted=None):
+    """
+    Find the colors of the text by row, where `base_row` is the row the text starts on.
+
+    Yields the row a color starts on, the row it ends on, and the packed palette color.
+    If `limit` is given, only colors that start before it (or on a row that an earlier
+    color ended on) are found, and the text after it is only scanned to complete them.
+    Stops early if `aborted` returns true.
+    """
+
+    row = base_row
+    last = 0
+    stop = limit
+    for m in color_re.finditer(text):
+        if aborted is not None and aborted():
+            return
+        start, end = m.span(0)
+        if stop is not None and start > stop:
+            break
+        color, alpha, alpha_dec = translate_color(m, use_hex_argb)
+        color += alpha if alpha is not None else 'ff'
+        dlevel = None
+        if not color.lower().endswith('ff'):
+            parts = alpha_dec.split('.')
+            dlevel = len(parts[1]) if len(parts) > 1 else None
+        row += text.count('\n', last, start)
+        last = start
+        end_row = row + text.count('\n', start, end)
+        if stop is not None and end > stop:
+            # The color runs past the limit, so the colors on the row it ends on are found too.
+            line_end = text.find('\n', end)
+            stop = len(text) if line_end == -1 else line_end
+        yield row, end_row, pack_palette_color(color, dlevel)
+
+
+def index_colors(source, color_re, use_hex_argb=False, aborted=None):
+    """
+    Index the colors of the source by row.
+
+    The source is a list of the base row and the text of each region.
+    Returns a dictionary of rows and the set of packed palette colors in them,
+    or `None` if `aborted` returns true while indexing.
+    """
+
+    colors = {}
+    for base_row, text in source:
+        if aborted is not None and aborted():
+            return None
+        for row, end_row, color in row_colors(text, base_row, color_re, use_hex_argb, aborted=aborted):
+            colors.setdefault(row, set()).add(color)
+        if aborted is not None and aborted():
+            return None
+    return colors
@@ -0,0 +1,291 @@
+"""
+ColorHelper engine color translation.
+
+Copyright (c) 2015 - 2017 Isaac Muse <isaacmuse@gmail.com>
+License: MIT
+"""
+from .. import csscolors
+from ..rgba import RGBA, round_int, clamp, fmt_float
+from .cache import LRUCache
+from .patterns import HEX_IS_GRAY_RE, HEX_COMPRESS_RE, COLOR_TYPES
+
+TRANSLATE_CACHE_SIZE = 4096
+
+
+def is_gray(color):
+    """Check if color is gray (all channels the same)."""
+
+    m = HEX_IS_GRAY_RE.match(color)
+    return m is not None
+
+
+def compress_hex(color):
+    """Compress hex."""
+
+    m = HEX_COMPRESS_RE.match(color)
+    if m:
+        color = '#' + m.group(1) + m.group(2) + m.group(3)
+        if m.group(4):
+            color += m.group(4)
+    return color
+
+
+def alpha_dec_normalize(dec):
+    """Normailze a deciaml alpha value."""
+
+    temp = float(dec)
+    if temp < 0.0 or temp > 1.0:
+        dec = fmt_float(clamp(float(temp), 0.0, 1.0), 3)
+    alpha_dec = dec
+    alpha = "%02X" % round_int(float(alpha_dec) * 255.0)
+    return alpha, alpha_dec
+
+
+def alpha_percent_normalize(perc):
+    """Normailze a percent alpha value."""
+
+    alpha_float = clamp(float(perc.strip('%')), 0.0, 100.0) / 100.0
+    alpha_dec = fmt_float(alpha_float, 3)
+    alpha = "%02X" % round_int(alpha_float * 255.0)
+    return alpha, alpha_dec
+
+
+def translate_hex_compressed(content, use_hex_argb):
+    """Translate a compressed hex color."""
+
+    color = "#%02x%02x%02x" % (
+        int(content[0:1] * 2, 16), int(content[1:2] * 2, 16), int(content[2:3] * 2, 16)
+    )
+    return color, None, None
+
+
+def translate_hexa_compressed(content, use_hex_argb):
+    """Translate a compressed hex color with alpha."""
+
+    if use_hex_argb:
+        color = "#%02x%02x%02x" % (
+            int(content[1:2] * 2, 16), int(content[2:3] * 2, 16), int(content[3:] * 2, 16)
+        )
+        alpha = content[0:1] * 2
+    else:
+        color = "#%02x%02x%02x" % (
+            int(content[0:1] * 2, 16), int(content[1:2] * 2, 16), int(content[2:3] * 2, 16)
+        )
+        alpha = content[3:] * 2
+    alpha_dec = fmt_float(float(int(alpha, 16)) / 255.0, 3)
+    return color, alpha, alpha_dec
+
+
+def translate_hex(content, use_hex_argb):
+    """Translate a hex color."""
+
+    color = "#%02x%02x%02x" % (
+        int(content[0:2], 16), int(content[2:4], 16), int(content[4:6], 16)
+    )
+    return color, None, None
+
+
+def translate_hexa(content, use_hex_argb):
+    """Translate a hex color with alpha."""
+
+    if use_hex_argb:
+        color = "#%02x%02x%02x" % (
+            int(content[2:4], 16), int(content[4:6], 16), int(content[6:], 16)
+        )
+        alpha = content[0:2]
+    else:
+        color = "#%02x%02x%02x" % (
+            int(content[0:2], 16), int(content[2:4], 16), int(content[4:6], 16)
+        )
+        alpha = content[6:]
+    alpha_dec = fmt_float(float(int(alpha, 16)) / 255.0, 3)
+    return color, alpha, alpha_dec
+
+
+def translate_rgb_channels(content):
+    """Translate RGB channels."""
+
+    if content[0].endswith('%'):
+        r = round_int(clamp(float(content[0].strip('%')), 0.0, 255.0) * (255.0 / 100.0))
+        g = round_int(clamp(float(content[1].strip('%')), 0.0, 255.0) * (255.0 / 100.0))
+        b = round_int(clamp(float(content[2].strip('%')), 0.0, 255.0) * (255.0 / 100.0))
+        color = "#%02x%02x%02x" % (r, g, b)
+    else:
+        color = "#%02x%02x%02x" % (
+            clamp(round_int(float(content[0])), 0, 255),
+            clamp(round_int(float(content[1])), 0, 255),
+            clamp(round_int(float(content[2])), 0, 255)
+        )
+    return color
+
+
+def translate_alpha(alpha):
+    """Translate an alpha channel."""
+
+    if alpha.endswith('%'):
+        return alpha_percent_normalize(alpha)
+    else:
+        return alpha_dec_normalize(alpha)
+
+
+def translate_rgb(content, use_hex_argb):
+    """Translate an RGB color."""
+
+    return translate_rgb_channels([x.strip() for x in content.split(',')]), None, None
+
+
+def translate_rgba(content, use_hex_argb):
+    """Translate an RGB color with alpha."""
+
+    content = [x.strip() for x in content.split(',')]
+    color = translate_rgb_channels(content)
+    alpha, alpha_dec = translate_alpha(content[3])
+    return color, alpha, alpha_dec
+
+
+def translate_gray_channel(content):
+    """Translate a gray channel."""
+
+    if content.endswith('%'):
+        g = round_int(clamp(float(content.strip('%')), 0.0, 255.0) * (255.0 / 100.0))
+    else:
+        g = clamp(round_int(float(content)), 0, 255)
+    return "#%02x%02x%02x" % (g, g, g)
+
+
+def translate_gray(content, use_hex_argb):
+    """Translate a gray color."""
+
+    return translate_gray_channel(content), None, None
+
+
+def translate_graya(content, use_hex_argb):
+    """Translate a gray color with alpha."""
+
+    content = [x.strip() for x in content.split(',')]
+    color = translate_gray_channel(content[0])
+    alpha, alpha_dec = translate_alpha(content[1])
+    return color, alpha, alpha_dec
+
+
+def translate_hsl_channels(content):
+    """Translate HSL channels."""
+
+    rgba = RGBA()
+    hue = float(content[0])
+    if hue < 0.0 or hue > 360.0:
+        hue = hue % 360.0
+    h = hue / 360.0
+    s = clamp(float(content[1].strip('%')), 0.0, 100.0) / 100.0
+    l = clamp(float(content[2].strip('%')), 0.0, 100.0) / 100.0
+    rgba.fromhls(h, l, s)
+    return rgba.get_rgb()
+
+
+def translate_hsl(content, use_hex_argb):
+    """Translate an HSL color."""
+
+    return translate_hsl_channels([x.strip() for x in content.split(',')]), None, None
+
+
+def translate_hsla(content, use_hex_argb):
+    """Translate an HSL color with alpha."""
+
+    content = [x.strip() for x in content.split(',')]
+    color = translate_hsl_channels(content)
+    alpha, alpha_dec = translate_alpha(content[3])
+    return color, alpha, alpha_dec
+
+
+def translate_hwb_channels(content):
+    """Translate HWB channels."""
+
+    rgba = RGBA()
+    hue = float(content[0])
+    if hue < 0.0 or hue > 360.0:
+        hue = hue % 360.0
+    h = hue / 360.0
+    w = clamp(float(content[1].strip('%')), 0.0, 100.0) / 100.0
+    b = clamp(float(content[2].strip('%')), 0.0, 100.0) / 100.0
+    rgba.fromhwb(h, w, b)
+    return rgba.get_rgb()
+
+
+def translate_hwb(content, use_hex_argb):
+    """Translate an HWB color."""
+
+    return translate_hwb_channels([x.strip() for x in content.split(',')]), None, None
+
+
+def translate_hwba(content, use_hex_argb):
+    """Translate an HWB color with alpha."""
+
+    content = [x.strip() for x in content.split(',')]
+    color = translate_hwb_channels(content)
+    alpha, alpha_dec = translate_alpha(content[3])
+    return color, alpha, alpha_dec
+
+
+def translate_webcolors(content, use_hex_argb):
+    """Translate a CSS color name."""
+
+    color = csscolors.name2hex(content)
+    return (color.lower() if color is not None else None), None, None
+
+
+TRANSLATORS = {
+    'hexa': translate_hexa,
+    'hex': translate_hex,
+    'hexa_compressed': translate_hexa_compressed,
+    'hex_compressed': translate_hex_compressed,
+    'rgb': translate_rgb,
+    'rgba': translate_rgba,
+    'hsl': translate_hsl,
+    'hsla': translate_hsla,
+    'hwb': translate_hwb,
+    'hwba': translate_hwba,
+    'gray': translate_gray,
+    'graya': translate_graya,
+    'webcolors': translate_webcolors
+}
+
+translate_cache = LRUCache(TRANSLATE_CACHE_SIZE)
+
+
+def translate_color(m, use_hex_argb=False, decode=False):
+    """
+    Translate the match object to a color w/ alpha.
+
+    Results are cached by the matched text, so repeated literals are only parsed once.
+    """
+
+    color_type = m.lastgroup
+    translator = TRANSLATORS.get(color_type)
+    if translator is None:
+        return None, None, None
+    key = (m.group(0), bool(use_hex_argb))
+    value = translate_cache.get(key)
+    if value is None:
+        content = m.group(color_type if color_type == 'webcolors' else color_type + '_content')
+        if decode:
+            content = content.decode('utf-8')
+        value = translator(content, use_hex_argb)
+        translate_cache.put(key, value)
+    return value
+
+
+def color_match(m, use_hex_argb=False, decode=False):
+    """
+    Classify a color match.
+
+    Returns the color type, the span of the color, and the normalized color (`#rrggbbaa`).
+    Incomplete colors are returned with a color of `None`.
+    """
+
+    color_type = m.lastgroup
+    rgba = None
+    if color_type in COLOR_TYPES:
+        color, alpha, alpha_dec = translate_color(m, use_hex_argb, decode)
+        if color is not None:
+            rgba = (color + (alpha if alpha is not None else 'ff')).lower()
+    return color_type, m.span(), rgba
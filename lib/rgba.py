@@ -5,12 +5,40 @@ Licensed under MIT
 Copyright (c) 2012 - 2016 Isaac Muse <isaacmuse@gmail.com>
 """
 import re
+import math
+from functools import lru_cache
 from colorsys import rgb_to_hls, hls_to_rgb, rgb_to_hsv, hsv_to_rgb
 import decimal
 
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional and only speeds up batch conversions.
+    numpy = None
+
 RGB_CHANNEL_SCALE = 1.0 / 255.0
 HUE_SCALE = 1.0 / 360.0
 
+FLOAT_TRIM_RE = re.compile(r'^(?P<keep>\d+)(?P<trash>\.0+|(?P<keep2>\.\d*[1-9])0+)$')
+
+# The float fast path is only used for precisions whose `Decimal` string form is never
+# scientific, and for scaled values small enough that a float can reliably flag possible ties.
+FLOAT_FAST_PRECISION = 6
+FLOAT_FAST_LIMIT = 2147483648.0
+FLOAT_TIE_EPSILON = 1e-6
+PRECISION_SCALE = [10 ** p for p in range(FLOAT_FAST_PRECISION + 1)]
+
+# Table backed conversions: channels are scaled by lookup and conversions of 24-bit colors are cached.
+CHANNEL_SCALE_TABLE = tuple(c * RGB_CHANNEL_SCALE for c in range(256))
+RED_PACK_TABLE = dict((c, c << 16) for c in range(256))
+GREEN_PACK_TABLE = dict((c, c << 8) for c in range(256))
+BLUE_PACK_TABLE = dict((c, c) for c in range(256))
+CONVERSION_CACHE_SIZE = 65536
+# Batches with fewer colors are converted in pure Python even if NumPy is available.
+BATCH_NUMPY_MIN = 64
+# The columns of a batch conversion (see `ColorColumns`).
+COLOR_COLUMNS = ('hex', 'alpha', 'rgb', 'hsl', 'hwb', 'luminance', 'name')
+
 
 def clamp(value, mn, mx):
     """Clamp the value to the the given minimum and maximum."""
@@ -21,16 +49,329 @@ def clamp(value, mn, mx):
 def round_int(dec):
     """Round float to nearest int using expected rounding."""
 
+    if isinstance(dec, float) and not (math.isinf(dec) or math.isnan(dec)):
+        # Subtracting the floor is exact, so this matches `ROUND_HALF_UP` on the exact value.
+        value = abs(dec)
+        whole = math.floor(value)
+        if value - whole >= 0.5:
+            whole += 1
+        return whole if dec >= 0 else -whole
+    elif isinstance(dec, int):
+        return int(dec)
     return int(decimal.Decimal(dec).quantize(decimal.Decimal('0'), decimal.ROUND_HALF_UP))
 
 
+def fmt_float(f, p=0):
+    """Set float precision and trim precision zeros."""
+
+    if p < 0:
+        p = 0
+
+    if (
+        isinstance(f, (float, int)) and p <= FLOAT_FAST_PRECISION and
+        -FLOAT_FAST_LIMIT < f * PRECISION_SCALE[p] < FLOAT_FAST_LIMIT
+    ):
+        # String formatting rounds the exact value correctly, but rounds exact ties to even.
+        # Only values that land (nearly) on a tie need to be checked exactly and rounded up.
+        scale = PRECISION_SCALE[p]
+        value = abs(float(f) * scale)
+        string = None
+        if abs(value - math.floor(value) - 0.5) <= FLOAT_TIE_EPSILON:
+            n, d = float(f).as_integer_ratio()
+            num = abs(n) * scale * 2
+            if num % d == 0 and (num // d) % 2:
+                digits = str((num // d + 1) // 2).rjust(p + 1, '0')
+                string = ('-' if f < 0 else '') + (digits[:-p] + '.' + digits[-p:] if p else digits)
+        if string is None:
+            string = '%.*f' % (p, f)
+        if p and string[-1] == '0' and string[0] != '-':
+            string = string.rstrip('0').rstrip('.')
+        return string
+
+    string = str(
+        decimal.Decimal(f).quantize(decimal.Decimal('0.' + ('0' * p) if p > 0 else '0'), decimal.ROUND_HALF_UP)
+    )
+
+    m = FLOAT_TRIM_RE.match(string)
+    if m:
+        string = m.group('keep')
+        if m.group('keep2'):
+            string += m.group('keep2')
+    return string
+
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def rgb24_to_hls(rgb):
+    """Convert a 24-bit RGB integer to HLS."""
+
+    return rgb_to_hls(
+        CHANNEL_SCALE_TABLE[rgb >> 16], CHANNEL_SCALE_TABLE[(rgb >> 8) & 0xFF], CHANNEL_SCALE_TABLE[rgb & 0xFF]
+    )
+
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def rgb24_to_hsv(rgb):
+    """Convert a 24-bit RGB integer to HSV."""
+
+    return rgb_to_hsv(
+        CHANNEL_SCALE_TABLE[rgb >> 16], CHANNEL_SCALE_TABLE[(rgb >> 8) & 0xFF], CHANNEL_SCALE_TABLE[rgb & 0xFF]
+    )
+
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def rgb24_to_hwb(rgb):
+    """Convert a 24-bit RGB integer to HWB."""
+
+    h, s, v = rgb_to_hsv(
+        CHANNEL_SCALE_TABLE[rgb >> 16], CHANNEL_SCALE_TABLE[(rgb >> 8) & 0xFF], CHANNEL_SCALE_TABLE[rgb & 0xFF]
+    )
+    return h, (1.0 - s) * v, 1.0 - v
+
+
+def pack_channels(r, g, b, a=0xFF):
+    """Pack byte channels into a 32-bit `0xRRGGBBAA` integer."""
+
+    return (r << 24) | (g << 16) | (b << 8) | a
+
+
+def pack_hex(value):
+    """
+    Pack a hex color string (or bytes) into a 32-bit `0xRRGGBBAA` integer.
+
+    Accepts `#RGB`, `#RGBA`, `#RRGGBB`, and `#RRGGBBAA` with or without the leading `#`.
+    """
+
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    if value[:1] == '#':
+        value = value[1:]
+    length = len(value)
+    if not value.isalnum() or length not in (3, 4, 6, 8):
+        raise ValueError('Invalid hex color: %r' % value)
+    if length < 6:
+        value = ''.join(c * 2 for c in value)
+    color = int(value, 16)
+    return color if length in (4, 8) else (color << 8) | 0xFF
+
+
+def unpack_channels(value):
+    """Unpack a 32-bit `0xRRGGBBAA` integer into byte channels: red, green, blue, alpha."""
+
+    return (value >> 24) & 0xFF, (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+def format_hex(value, alpha=True):
+    """Format a 32-bit `0xRRGGBBAA` integer as a lowercase `#rrggbbaa` (or `#rrggbb`) string."""
+
+    return '#%08x' % value if alpha else '#%06x' % (value >> 8)
+
+
+def clear_conversion_cache():
+    """Clear the cached conversions."""
+
+    rgb24_to_hls.cache_clear()
+    rgb24_to_hsv.cache_clear()
+    rgb24_to_hwb.cache_clear()
+
+
+class ColorColumns(object):
+    """
+    Columnar conversions of a batch of colors.
+
+    Each column is a list with an entry per color:
+
+    - `packed`: `0xRRGGBBAA` integer.
+    - `hex`: lowercase `#rrggbb` string.
+    - `alpha`: alpha channel byte.
+    - `rgb`: red, green, and blue channel bytes.
+    - `hsl`: hue, saturation, and lightness (0 - 1).
+    - `hwb`: hue, whiteness, and blackness (0 - 1).
+    - `luminance`: perceived luminance (0 - 255).
+    - `name`: CSS color name or `None`.
+
+    Columns that weren't asked for are `None`.
+    """
+
+    __slots__ = ('packed', 'hex', 'alpha', 'rgb', 'hsl', 'hwb', 'luminance', 'name')
+
+    def __init__(self, packed, hsl, hwb, luminance, names=None, columns=COLOR_COLUMNS):
+        """Initialize."""
+
+        self.packed = packed
+        self.hex = None
+        self.alpha = None
+        self.rgb = None
+        self.hsl = hsl
+        self.hwb = hwb
+        self.luminance = luminance
+        self.name = None
+        if 'hex' in columns or ('name' in columns and names):
+            self.hex = ['#%06x' % (value >> 8) for value in packed]
+        if 'alpha' in columns:
+            self.alpha = [value & 0xFF for value in packed]
+        if 'rgb' in columns:
+            self.rgb = [((value >> 24) & 0xFF, (value >> 16) & 0xFF, (value >> 8) & 0xFF) for value in packed]
+        if 'name' in columns:
+            self.name = [names.get(color) for color in self.hex] if names else [None] * len(packed)
+
+    def __len__(self):
+        """Get the number of colors."""
+
+        return len(self.packed)
+
+
+def _convert_python(packed, columns):
+    """Convert packed colors one at a time (using the cached conversions)."""
+
+    hsl = [] if 'hsl' in columns else None
+    hwb = [] if 'hwb' in columns else None
+    luminance = [] if 'luminance' in columns else None
+    for value in packed:
+        rgb = value >> 8
+        if hsl is not None:
+            h, l, s = rgb24_to_hls(rgb)
+            hsl.append((h, s, l))
+        if hwb is not None:
+            hwb.append(rgb24_to_hwb(rgb))
+        if luminance is not None:
+            luminance.append(
+                clamp(round_int(0.299 * (rgb >> 16) + 0.587 * ((rgb >> 8) & 0xFF) + 0.114 * (rgb & 0xFF)), 0, 255)
+            )
+    return hsl, hwb, luminance
+
+
+def _hue_numpy(r, g, b, maxc, rangec):
+    """Get the hue of channel arrays exactly like `colorsys`."""
+
+    rc = (maxc - r) / rangec
+    gc = (maxc - g) / rangec
+    bc = (maxc - b) / rangec
+    h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    return (h / 6.0) % 1.0
+
+
+def _convert_numpy(packed, columns):
+    """Convert packed colors with NumPy, following the `colorsys` math operation for operation."""
+
+    values = numpy.array(packed, dtype=numpy.uint32)
+    r8 = (values >> 24) & 0xFF
+    g8 = (values >> 16) & 0xFF
+    b8 = (values >> 8) & 0xFF
+    hsl = hwb = luminance = None
+
+    if 'hsl' in columns or 'hwb' in columns:
+        r = r8 * RGB_CHANNEL_SCALE
+        g = g8 * RGB_CHANNEL_SCALE
+        b = b8 * RGB_CHANNEL_SCALE
+        maxc = numpy.maximum(numpy.maximum(r, g), b)
+        minc = numpy.minimum(numpy.minimum(r, g), b)
+        rangec = maxc - minc
+        gray = rangec == 0.0
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            hue = numpy.where(gray, 0.0, _hue_numpy(r, g, b, maxc, rangec)).tolist()
+            if 'hsl' in columns:
+                sumc = maxc + minc
+                l = sumc / 2.0
+                s = numpy.where(gray, 0.0, numpy.where(l <= 0.5, rangec / sumc, rangec / (2.0 - maxc - minc)))
+                hsl = list(zip(hue, s.tolist(), l.tolist()))
+            if 'hwb' in columns:
+                sv = numpy.where(gray, 0.0, rangec / maxc)
+                hwb = list(zip(hue, ((1.0 - sv) * maxc).tolist(), (1.0 - maxc).tolist()))
+
+    if 'luminance' in columns:
+        lum = 0.299 * r8 + 0.587 * g8 + 0.114 * b8
+        whole = numpy.floor(lum)
+        luminance = numpy.clip(whole + (lum - whole >= 0.5), 0, 255).astype(int).tolist()
+    return hsl, hwb, luminance
+
+
+def convert_colors(colors, names=None, backend=None, columns=COLOR_COLUMNS):
+    """
+    Convert a batch of colors in one pass and get the results as columns (`ColorColumns`).
+
+    Colors are hex strings (see `pack_hex`) or packed `0xRRGGBBAA` integers.
+    `names` maps lowercase `#rrggbb` strings to color names.
+    Only the given `columns` (see `COLOR_COLUMNS`) are computed, the `packed` column always is.
+    The `backend` is `numpy` or `python`; by default NumPy is used for larger batches if it is installed.
+    Both backends give identical results.
+    """
+
+    columns = frozenset(columns)
+    packed = [value if isinstance(value, int) else pack_hex(value) for value in colors]
+    if backend is None:
+        backend = 'numpy' if numpy is not None and len(packed) >= BATCH_NUMPY_MIN else 'python'
+    if backend == 'numpy' and numpy is None:
+        raise ValueError('NumPy is not available')
+    if not columns & {'hsl', 'hwb', 'luminance'}:
+        hsl = hwb = luminance = None
+    elif backend == 'numpy' and packed:
+        hsl, hwb, luminance = _convert_numpy(packed, columns)
+    else:
+        hsl, hwb, luminance = _convert_python(packed, columns)
+    return ColorColumns(packed, hsl, hwb, luminance, names, columns)
+
+
+class PackedColor(int):
+    """Immutable color packed into a 32-bit `0xRRGGBBAA` integer."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_int(cls, value):
+        """Create from a 32-bit `0xRRGGBBAA` integer."""
+
+        if not 0 <= value <= 0xFFFFFFFF:
+            raise ValueError('Invalid packed color: %r' % value)
+        return cls(value)
+
+    @classmethod
+    def from_hex_bytes(cls, value):
+        """Create from a hex color string (or bytes)."""
+
+        return cls(pack_hex(value))
+
+    @property
+    def r(self):
+        """Red channel."""
+
+        return (self >> 24) & 0xFF
+
+    @property
+    def g(self):
+        """Green channel."""
+
+        return (self >> 16) & 0xFF
+
+    @property
+    def b(self):
+        """Blue channel."""
+
+        return (self >> 8) & 0xFF
+
+    @property
+    def a(self):
+        """Alpha channel."""
+
+        return self & 0xFF
+
+    def to_hex(self, alpha=True):
+        """Get the `#rrggbbaa` (or `#rrggbb`) string."""
+
+        return format_hex(self, alpha)
+
+    def to_rgba(self):
+        """Get an `RGBA` object of the color."""
+
+        return RGBA.from_int(self)
+
+
 class RGBA(object):
     """RGBA object for converting between color formats or applying filters to the color."""
 
-    r = None
-    g = None
-    b = None
-    a = None
+    __slots__ = ('r', 'g', 'b', 'a')
+
+    conversion_tables = True
     color_pattern = re.compile(r"^#(?:([A-Fa-f\d]{6})([A-Fa-f\d]{2})?|([A-Fa-f\d]{3}))")
 
     def __init__(self, s=None):
@@ -40,6 +381,25 @@ class RGBA(object):
             s = "#000000FF"
         self.r, self.g, self.b, self.a = self._split_channels(s)
 
+    @classmethod
+    def from_int(cls, value):
+        """Create from a 32-bit `0xRRGGBBAA` integer without parsing a string."""
+
+        rgba = cls.__new__(cls)
+        rgba.r, rgba.g, rgba.b, rgba.a = unpack_channels(value)
+        return rgba
+
+    @classmethod
+    def from_hex_bytes(cls, value):
+        """Create from a hex color string (or bytes) without the regular expression."""
+
+        return cls.from_int(pack_hex(value))
+
+    def to_int(self):
+        """Get the color as a 32-bit `0xRRGGBBAA` integer."""
+
+        return pack_channels(int(self.r), int(self.g), int(self.b), int(self.a))
+
     def _split_channels(self, s):
         """Split the color into color channels: red, green, blue, alpha."""
 
@@ -128,9 +488,22 @@ class RGBA(object):
         l = clamp(l + factor - 1.0, 0.0, 1.0)
         self.fromhls(h, l, s)
 
+    def _get_rgb24(self):
+        """Get the 24-bit RGB integer if conversion tables are enabled and the channels are whole bytes."""
+
+        if self.conversion_tables:
+            try:
+                return RED_PACK_TABLE[self.r] | GREEN_PACK_TABLE[self.g] | BLUE_PACK_TABLE[self.b]
+            except KeyError:
+                pass
+        return None
+
     def tohsv(self):
         """Convert to HSV color format."""
 
+        rgb = self._get_rgb24()
+        if rgb is not None:
+            return rgb24_to_hsv(rgb)
         return rgb_to_hsv(self.r * RGB_CHANNEL_SCALE, self.g * RGB_CHANNEL_SCALE, self.b * RGB_CHANNEL_SCALE)
 
     def fromhsv(self, h, s, v):
@@ -144,6 +517,9 @@ class RGBA(object):
     def tohls(self):
         """Convert to HLS color format."""
 
+        rgb = self._get_rgb24()
+        if rgb is not None:
+            return rgb24_to_hls(rgb)
         return rgb_to_hls(self.r * RGB_CHANNEL_SCALE, self.g * RGB_CHANNEL_SCALE, self.b * RGB_CHANNEL_SCALE)
 
     def fromhls(self, h, l, s):
@@ -157,6 +533,9 @@ class RGBA(object):
     def tohwb(self):
         """Convert to HWB from RGB."""
 
+        rgb = self._get_rgb24()
+        if rgb is not None:
+            return rgb24_to_hwb(rgb)
         h, s, v = self.tohsv()
         w = (1.0 - s) * v
         b = 1.0 - v
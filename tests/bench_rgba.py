@@ -0,0 +1,73 @@
+"""
+Benchmark table backed RGBA conversions.
+
+Compares `RGBA.tohls` and `RGBA.tohwb` using the conversion tables against the pure `colorsys` path.
+
+    python -m tests.bench_rgba [count]
+"""
+import random
+import sys
+import timeit
+from lib import rgba
+
+
+def make_colors(count, distinct=None, seed=0):
+    """Create RGBA objects for random colors, optionally drawn from a limited set of distinct colors."""
+
+    rand = random.Random(seed)
+    if distinct is None:
+        values = [rand.getrandbits(24) for _ in range(count)]
+    else:
+        pool = [rand.getrandbits(24) for _ in range(distinct)]
+        values = [rand.choice(pool) for _ in range(count)]
+    return [rgba.RGBA('#%06x' % value) for value in values]
+
+
+def convert(colors):
+    """Convert all colors to HSL and HWB."""
+
+    for color in colors:
+        color.tohls()
+        color.tohwb()
+
+
+def run(colors, tables):
+    """Time conversions with or without the conversion tables."""
+
+    rgba.RGBA.conversion_tables = tables
+    rgba.clear_conversion_cache()
+    try:
+        return timeit.timeit(lambda: convert(colors), number=1)
+    finally:
+        rgba.RGBA.conversion_tables = True
+
+
+def check(colors):
+    """Verify the table results are identical to `colorsys`."""
+
+    for color in colors:
+        rgba.RGBA.conversion_tables = False
+        expected = (color.tohls(), color.tohsv(), color.tohwb())
+        rgba.RGBA.conversion_tables = True
+        assert (color.tohls(), color.tohsv(), color.tohwb()) == expected, color.get_rgb()
+
+
+def main(argv):
+    """Run the benchmark."""
+
+    count = int(argv[0]) if argv else 1000000
+    for label, distinct in (('random', None), ('1000 distinct', 1000)):
+        colors = make_colors(count, distinct)
+        check(colors[:10000])
+        plain = run(colors, False)
+        tables = run(colors, True)
+        print(
+            '%s colors (%s): colorsys %.3fs, tables %.3fs, speedup %.2fx' % (
+                count, label, plain, tables, plain / tables
+            )
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+"""
+Benchmark color scanning throughput.
+
+Compares scanning with the literal prefilter against running the full color regex at every position,
+and the color name trie against a flat alternation of the names on identifier heavy SCSS.
+A synthetic CSS/SCSS corpus is generated unless files are given.
+
+    python -m tests.bench_scanner [rules] [files...]
+"""
+import random
+import re
+import sys
+import timeit
+from lib import csscolors
+from lib.engine import patterns
+
+PROPERTIES = (
+    'color', 'background-color', 'border', 'border-color', 'margin', 'padding', 'font-family',
+    'display', 'width', 'box-shadow', 'transition', 'outline'
+)
+
+IDENTIFIERS = (
+    'header', 'nav-item', 'content', 'sidebar', 'button', 'primary', 'is-active', 'card', 'title',
+    'footer', 'container', 'wrapper', 'theme', 'accent', 'brand', 'muted'
+)
+
+KEYWORDS = ('solid', 'auto', 'inherit', 'none', 'block', 'ease-in-out', 'transparent', 'flex')
+
+# Identifiers that start with or contain color names.
+NAME_LIKE = (
+    'redirect', 'tangent', 'orchid-menu', 'bluetooth', 'greenfield', 'linear', 'navbar', 'whitespace',
+    'goldenratio', 'snowflake', 'linen-card', 'khaki-theme', 'plumbing', 'oldlace-border'
+)
+
+# The flat alternation of color names that the trie replaced.
+NAMES_ALTERNATION = r'\b(?P<webcolors>%s)\b(?!\()' % '|'.join(csscolors.name2hex_map.keys())
+
+
+def make_corpus(rules, seed=0):
+    """Create a SCSS corpus with variables, nested rules, and colors in every format."""
+
+    rand = random.Random(seed)
+    names = sorted(csscolors.name2hex_map.keys())
+    out = []
+    for _ in range(rules):
+        out.append('.%s-%s {' % (rand.choice(IDENTIFIERS), rand.choice(IDENTIFIERS)))
+        for _ in range(rand.randint(3, 8)):
+            kind = rand.random()
+            if kind < 0.1:
+                value = '#%06x' % rand.getrandbits(24)
+            elif kind < 0.15:
+                value = 'rgba(%d, %d, %d, 0.5)' % (rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255))
+            elif kind < 0.18:
+                value = rand.choice(names)
+            elif kind < 0.2:
+                value = 'hsl(%d, 50%%, 50%%)' % rand.randint(0, 360)
+            elif kind < 0.5:
+                value = '$%s-%s' % (rand.choice(IDENTIFIERS), rand.choice(IDENTIFIERS))
+            else:
+                value = '%dpx %s' % (rand.randint(0, 40), rand.choice(KEYWORDS))
+            out.append('  %s: %s;' % (rand.choice(PROPERTIES), value))
+        out.append('}')
+    return '\n'.join(out)
+
+
+def make_identifier_corpus(rules, seed=0):
+    """Create a SCSS corpus of mixins, variables, and selectors where most words are not colors."""
+
+    rand = random.Random(seed)
+    names = sorted(csscolors.name2hex_map.keys())
+    words = IDENTIFIERS + NAME_LIKE
+    out = []
+    for _ in range(rules):
+        a, b, c = rand.choice(words), rand.choice(words), rand.choice(words)
+        value = rand.choice(names) if rand.random() < 0.1 else '$' + a
+        out.append(
+            '.%s-%s { @include %s($%s-%s, %s); color: %s; }' % (
+                a, b, c, a, c, rand.choice(('inherit', 'currentColor', '$' + b, rand.choice(names))), value
+            )
+        )
+    return '\n'.join(out)
+
+
+def scan(finditer, text):
+    """Get the spans of all colors in the text."""
+
+    return [m.span() for m in finditer(text)]
+
+
+def main(argv):
+    """Run the benchmark."""
+
+    rules = int(argv[0]) if argv else 20000
+    corpora = [('synthetic SCSS', make_corpus(rules))]
+    for path in argv[1:]:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            corpora.append((path, f.read()))
+
+    for label, text in corpora:
+        size = len(text) / (1024.0 * 1024.0)
+        for name, color_re in (('COLOR_RE', patterns.COLOR_RE), ('COLOR_ALL_RE', patterns.COLOR_ALL_RE)):
+            expected = scan(color_re.regex.finditer, text)
+            assert scan(color_re.finditer, text) == expected, 'results differ'
+            plain = timeit.timeit(lambda: scan(color_re.regex.finditer, text), number=1)
+            prefiltered = timeit.timeit(lambda: scan(color_re.finditer, text), number=1)
+            print(
+                '%s, %s (%.1f MB, %d colors): regex %.1f MB/s, prefilter %.1f MB/s, speedup %.2fx' % (
+                    label, name, size, len(expected), size / plain, size / prefiltered, plain / prefiltered
+                )
+            )
+
+    text = make_identifier_corpus(rules)
+    size = len(text) / (1024.0 * 1024.0)
+    alternation = re.compile(r'(?i)' + NAMES_ALTERNATION)
+    trie = re.compile(r'(?i)' + patterns.COLOR_NAMES)
+    expected = scan(alternation.finditer, text)
+    assert scan(trie.finditer, text) == expected, 'results differ'
+    flat = timeit.timeit(lambda: scan(alternation.finditer, text), number=1)
+    nested = timeit.timeit(lambda: scan(trie.finditer, text), number=1)
+    print(
+        'identifier SCSS, names (%.1f MB, %d names): alternation %.1f MB/s, trie %.1f MB/s, speedup %.2fx' % (
+            size, len(expected), size / flat, size / nested, flat / nested
+        )
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
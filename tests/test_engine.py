@@ -0,0 +1,452 @@
+"""Test the headless color engine in `lib.engine`."""
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+from lib import csscolors
+from lib.engine import patterns, translate, scanner, insert, convert, project, index
+
+
+class TestTranslate(unittest.TestCase):
+    """Test color translation."""
+
+    def translate(self, text, use_hex_argb=False):
+        """Translate the first color in the text."""
+
+        return translate.translate_color(patterns.COLOR_RE.search(text), use_hex_argb)
+
+    def test_formats(self):
+        """Test that each format translates to hex."""
+
+        self.assertEqual(self.translate('#abc')[0], '#aabbcc')
+        self.assertEqual(self.translate('#AABBCC')[0], '#aabbcc')
+        self.assertEqual(self.translate('rgb(255, 0, 0)')[0], '#ff0000')
+        self.assertEqual(self.translate('hsl(120, 100%, 50%)')[0].lower(), '#00ff00')
+        self.assertEqual(self.translate('hwb(240, 0%, 0%)')[0].lower(), '#0000ff')
+        self.assertEqual(self.translate('gray(128)')[0], '#808080')
+        self.assertEqual(self.translate('red')[0], '#ff0000')
+
+    def test_alpha(self):
+        """Test the alpha channel."""
+
+        color, alpha, alpha_dec = self.translate('rgba(255, 0, 0, 0.5)')
+        self.assertEqual((color, alpha, alpha_dec), ('#ff0000', '80', '0.5'))
+        self.assertEqual(self.translate('#11223344')[:2], ('#112233', '44'))
+        self.assertEqual(self.translate('#11223344', use_hex_argb=True)[:2], ('#223344', '11'))
+
+    def test_color_match(self):
+        """Test normalizing a match."""
+
+        self.assertEqual(
+            translate.color_match(patterns.COLOR_RE.search('#fff')),
+            ('hex_compressed', (0, 4), '#ffffffff')
+        )
+
+
+class TestPrefilter(unittest.TestCase):
+    """Test that the literal prefilter finds the same colors as the full regex."""
+
+    TEXT = (
+        '#fff #ffff #ffffff #ffffffff #fff#000 @red .red $red -red red_ red( redder tan tangent\n'
+        'rgb(1, 2, 3) rgba(1, 2, 3, 0.5) RGB(10%, 20%, 30%) rgb( hsl(1, 2%, 3%) hsla(\n'
+        'hwb(1, 2%, 3%, 0.5) gray(50%) gray( grey darkslategray lightgoldenrodyellow #'
+    )
+
+    def assert_same(self, color_re):
+        """Assert the prefiltered and plain matches are the same."""
+
+        expected = [(m.span(), m.lastgroup) for m in color_re.regex.finditer(self.TEXT)]
+        self.assertTrue(expected)
+        self.assertEqual([(m.span(), m.lastgroup) for m in color_re.finditer(self.TEXT)], expected)
+        for pos in (0, 40, 150):
+            m = color_re.search(self.TEXT, pos)
+            expected = color_re.regex.search(self.TEXT, pos)
+            self.assertEqual(m and m.span(), expected and expected.span())
+
+    def test_all(self):
+        """Test all color formats."""
+
+        self.assert_same(patterns.COLOR_RE)
+        self.assert_same(patterns.COLOR_ALL_RE)
+
+    def test_allowed(self):
+        """Test restricted color formats."""
+
+        for allowed in (('hex', 'hexa'), ('webcolors',), ('rgb', 'hsla', 'gray'), ('hwb', 'hex_compressed')):
+            self.assert_same(patterns.get_color_re(allowed))
+            self.assert_same(patterns.get_color_re(allowed, incomplete=True))
+
+    def test_none(self):
+        """Test that no colors are found if no formats are allowed."""
+
+        self.assertEqual(list(patterns.get_color_re([]).finditer(self.TEXT)), [])
+
+
+class TestColorNames(unittest.TestCase):
+    """Test the color name trie."""
+
+    def test_names(self):
+        """Test that every name is matched whole, and only whole words are matched."""
+
+        names = sorted(csscolors.name2hex_map.keys())
+        text = ' '.join(names + ['redder', 'tan-', 'xred', 'Navy', 'DarkSlateGray', 'blue(', 'gold_'])
+        found = [m.group('webcolors') for m in patterns.COLOR_RE.finditer(text)]
+        self.assertEqual(found, names + ['Navy', 'DarkSlateGray'])
+
+    def test_trie_pattern(self):
+        """Test that the longest word is matched."""
+
+        pattern = re.compile(patterns.trie_pattern(['tan', 'tango', 'tea', 'a']))
+        self.assertEqual([m.group(0) for m in pattern.finditer('tango tan tea')], ['tango', 'tan', 'tea'])
+
+
+class TestScanner(unittest.TestCase):
+    """Test the color scanner."""
+
+    def test_get_scanner(self):
+        """Test that scanners only match the allowed formats and are shared by equal sets."""
+
+        color_scanner = scanner.get_scanner(['hex', 'hexa', 'hex_compressed'])
+        self.assertIs(scanner.get_scanner({'hex_compressed', 'hexa', 'hex'}), color_scanner)
+        self.assertIsNot(scanner.get_scanner(['hex']), color_scanner)
+        text = 'red rgb(0, 0, 0) #fff #abcdef #'
+        self.assertEqual([m.group(0) for m in color_scanner.color_re.finditer(text)], ['#fff', '#abcdef'])
+        self.assertEqual([m.group(0) for m in color_scanner.incomplete_re.finditer(text)], ['#fff', '#abcdef', '#'])
+
+    def test_find_colors(self):
+        """Test that colors are found at buffer offsets within the bounds."""
+
+        text = 'a: #fff; b: red; c: rgb(0, 0, 0);'
+        found = [(s, e, m.lastgroup) for s, e, m in scanner.find_colors(text, 100, patterns.COLOR_RE)]
+        self.assertEqual(found, [(103, 107, 'hex_compressed'), (112, 115, 'webcolors'), (120, 132, 'rgb')])
+        found = [(s, e) for s, e, m in scanner.find_colors(text, 100, patterns.COLOR_RE, 104, 116)]
+        self.assertEqual(found, [(112, 115)])
+
+    def test_color_at(self):
+        """Test finding the color at an index."""
+
+        text = 'color: #fff; x: rgb(1, 2, 3) rgb('
+        color_re = patterns.get_color_re(patterns.ALL, incomplete=True)
+        found = scanner.color_at(text, 8, color_re)
+        self.assertEqual(
+            (found.span, found.color_type, found.complete, found.at_end), ((7, 11), 'hex_compressed', True, False)
+        )
+        self.assertIsNone(scanner.color_at(text, 11, color_re))
+        self.assertTrue(scanner.color_at(text, 11, color_re, touching=True).at_end)
+        self.assertIsNone(scanner.color_at(text, 2, color_re))
+        self.assertEqual(scanner.color_at(text, 24, color_re).span, (16, 28))
+        found = scanner.color_at(text, len(text), color_re, touching=True)
+        self.assertEqual((found.color_type, found.complete, found.at_end), ('rgb_open', False, True))
+
+    def test_color_at_search(self):
+        """Test that the anchored lookup finds the same colors as searching from the start."""
+
+        text = 'a: #fff;\nb: rgba(1, 2, 3, .5) red tangent .red #12345678 hsl(1, 2%, 3%) #zz gray('
+        for color_re in (patterns.COLOR_RE, patterns.COLOR_ALL_RE, patterns.get_color_re(['hex'], incomplete=True)):
+            matches = list(color_re.finditer(text))
+            for ref in range(len(text) + 1):
+                found = scanner.color_at(text, ref, color_re)
+                expected = [m.span() for m in matches if m.start(0) <= ref < m.end(0)]
+                self.assertEqual([found.span] if found else [], expected)
+
+    def test_validate_color(self):
+        """Test revalidating a previewed color."""
+
+        self.assertEqual(scanner.validate_color(' #fff ', 10, 11, 4, 'hex_compressed'), '#ffffffff')
+        self.assertIsNone(scanner.validate_color(' #ffff ', 10, 11, 4, 'hex_compressed'))
+        self.assertIsNone(scanner.validate_color(' #fff ', 10, 12, 4, 'hex_compressed'))
+
+    def test_index_colors(self):
+        """Test indexing colors by row."""
+
+        source = [(0, '#fff\nred\n\nrgba(0, 0, 0, 0.25) #fff'), (10, 'blue')]
+        colors = scanner.index_colors(source, patterns.COLOR_RE)
+        self.assertEqual(
+            {row: sorted(convert.format_palette_color(c) for c in v) for row, v in colors.items()},
+            {0: ['#ffffffff'], 1: ['#ff0000ff'], 3: ['#00000040@2', '#ffffffff'], 10: ['#0000ffff']}
+        )
+        self.assertIsNone(scanner.index_colors(source, patterns.COLOR_RE, aborted=lambda: True))
+
+
+class TestFileIndex(unittest.TestCase):
+    """Test that the incremental file index matches a full rebuild."""
+
+    COMMENT_RE = re.compile(r'/\*.*?(?:\*/|$)', re.DOTALL)
+
+    FRAGMENTS = (
+        'rgba(1,', '2, 3, .5)', ' 2,\n 3,\n', 'rgb(\n1,\n2,\n3)', '\n 4,\n', 'rgb(\n', 'hsl(', 'gray(',
+        '10%', '50%', ',', ')', ';', ' ', 'x', '\n', '\n\n', 'red', 'tan', '#fff', '#123456', '/*', '*/'
+    )
+
+    def get_regions(self, text, comments):
+        """Get the scannable regions, outside of comments if enabled."""
+
+        if not comments:
+            return [(0, len(text))]
+        regions = []
+        last = 0
+        for m in self.COMMENT_RE.finditer(text):
+            regions.append((last, m.start(0)))
+            last = m.end(0)
+        regions.append((last, len(text)))
+        return regions
+
+    def scan(self, file_index, text, rows):
+        """Scan the rows and update the index."""
+
+        colors, ends = index.scan_source(file_index.get_source(text, rows), patterns.COLOR_RE)
+        file_index.update_rows(rows, {row: list(c) for row, c in colors.items()}, ends)
+
+    def build(self, text, comments=False):
+        """Build a full index."""
+
+        file_index = index.FileIndex(patterns.ALL, False)
+        file_index.snapshot(text, self.get_regions(text, comments))
+        self.scan(file_index, text, None)
+        return file_index
+
+    def edit(self, file_index, text, comments=False):
+        """Update the index incrementally."""
+
+        rows = file_index.invalidate(text, self.get_regions(text, comments))
+        self.scan(file_index, text, rows)
+
+    def assert_same(self, file_index, text, comments=False):
+        """Assert that the index matches a full rebuild."""
+
+        expected = self.build(text, comments)
+        self.assertEqual(
+            ({row: sorted(c) for row, c in file_index.rows.items()}, file_index.palette),
+            ({row: sorted(c) for row, c in expected.rows.items()}, expected.palette),
+            repr(text)
+        )
+
+    def test_multiline(self):
+        """Test that colors spanning lines are kept and found when rows around them change."""
+
+        text = 'a\nb: rgba(1,\n2, 3, .5);\n'
+        file_index = self.build(text)
+        self.assertEqual(file_index.ends, {1: 2})
+        for edited in (
+            'ab\nb: rgba(1,\n2, 3, .5);\n',
+            'ab\nb: rgba(1,\n2, 3, .5); red\n',
+            'ab\nb: rgba(\n1,\n2,\n3,\n.5); red\n',
+            'ab\nb: rgba(\n1,\n2,\n3,\n.5)x red\n',
+            'ab\nb: rgba(\n1,\n\n2,\n3,\n.5) red\n',
+            'ab\nb: red\n'
+        ):
+            self.edit(file_index, edited)
+            self.assert_same(file_index, edited)
+
+    def test_random_edits(self):
+        """Test random edits against full rebuilds, with and without comments."""
+
+        rand = random.Random(0)
+        for comments in (False, True):
+            text = ''.join(rand.choice(self.FRAGMENTS) for _ in range(50))
+            file_index = self.build(text, comments)
+            for _ in range(1000):
+                pos = rand.randint(0, len(text))
+                if text and rand.random() < 0.4:
+                    text = text[:pos] + text[pos + rand.randint(1, 8):]
+                else:
+                    text = text[:pos] + rand.choice(self.FRAGMENTS) + text[pos:]
+                self.edit(file_index, text, comments)
+                self.assert_same(file_index, text, comments)
+
+
+class TestInsert(unittest.TestCase):
+    """Test insert calculation."""
+
+    def test_replace(self):
+        """Test replacing a color with another format."""
+
+        text = 'color: #ff000080;'
+        calc = insert.InsertCalc(text, 50, 60, '#00ff00', 'rgb', patterns.ALL, False)
+        self.assertTrue(calc.calc())
+        self.assertEqual(calc.span, (57, 66))
+        self.assertEqual(calc.get_value('rgb'), 'rgb(0, 255, 0)')
+
+        calc = insert.InsertCalc(text, 50, 60, '#00ff00', 'rgba', patterns.ALL, False)
+        self.assertTrue(calc.calc())
+        self.assertEqual(calc.get_value('rgba'), 'rgba(0, 255, 0, 0.502)')
+
+    def test_complete(self):
+        """Test completing an incomplete color."""
+
+        text = 'color: rgb()'
+        calc = insert.InsertCalc(text, 0, 11, '#00ff00', 'rgb', patterns.ALL, False, ')')
+        self.assertTrue(calc.calc())
+        self.assertEqual(calc.span, (7, 12))
+
+        calc = insert.PickerInsertCalc('color: #', 0, 8, patterns.ALL)
+        self.assertTrue(calc.calc())
+        self.assertEqual(calc.span, (7, 8))
+
+    def test_values(self):
+        """Test the inserted value of each format."""
+
+        def value(convert):
+            calc = insert.InsertCalc('', 0, 0, '#336699', convert, patterns.ALL, False)
+            calc.calc()
+            return calc.get_value(convert, compress_hex=True, upper=True)
+
+        self.assertEqual(value('hex'), '#369')
+        self.assertEqual(value('hexa'), '#369F')
+        self.assertEqual(value('hsl'), 'hsl(210, 50%, 40%)')
+        self.assertEqual(value('hwb'), 'hwb(210, 20%, 40%)')
+        self.assertEqual(value('gray'), 'gray(51)')
+        self.assertEqual(insert.InsertCalc('', 0, 0, '#ff0000', 'name', patterns.ALL, False).get_value('name'), 'red')
+
+
+class TestProject(unittest.TestCase):
+    """Test the project color index."""
+
+    RULES = [
+        {"base_scopes": ["source.css", "text.html"], "scan_scopes": ["source.css"], "allowed_colors": ["css3"]},
+        {"base_scopes": ["source.scss"], "scan_scopes": ["source.scss"], "allowed_colors": ["css4"]},
+        {
+            "base_scopes": ["text.xml"], "scan_scopes": ["text.xml"], "allowed_colors": ["hex", "hexa"],
+            "extensions": [".tmTheme"], "use_hex_argb": True, "max_file_size": 20
+        },
+        {"base_scopes": ["source.less"], "scan_scopes": [], "allowed_colors": ["css3"]}
+    ]
+
+    FILES = {
+        'a.css': '.a { color: #fff; background: gray(50%); }',
+        'b.scss': '$a: gray(50%); $b: red;',
+        'c.tmTheme': '#80ff0000',
+        'big.tmTheme': '<string>#80ff0000</string>',
+        'd.less': '@a: red;',
+        'e.txt': 'red',
+        'skip/f.css': 'blue',
+        '.git/g.css': 'blue',
+        'sub/h.html': '<p style="color: rgb(0, 0, 255)">'
+    }
+
+    def setUp(self):
+        """Create the project folder."""
+
+        self.root = tempfile.mkdtemp()
+        for name, text in self.FILES.items():
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        """Remove the project folder."""
+
+        shutil.rmtree(self.root)
+
+    def find_files(self):
+        """Find the files of the project folder."""
+
+        folders = [{'path': self.root, 'folder_exclude_patterns': ['skip']}]
+        return [(os.path.relpath(f[0], self.root), f[1], f[2]) for f in project.find_files(folders, self.RULES)]
+
+    def test_file_rules(self):
+        """Test matching rules by extension."""
+
+        rules = project.get_file_rules('x/a.scss', self.RULES)
+        self.assertEqual(rules['allowed_colors'], set(patterns.CSS4))
+        rules = project.get_file_rules('x/a.TMTHEME', self.RULES)
+        self.assertEqual((rules['allowed_colors'], rules['use_hex_argb']), ({"hex", "hexa"}, True))
+        self.assertIsNone(project.get_file_rules('x/a.less', self.RULES))
+        self.assertIsNone(project.get_file_rules('x/css', self.RULES))
+
+    def test_find_files(self):
+        """Test finding the files with scan rules."""
+
+        self.assertEqual(
+            [(f[0].replace(os.sep, '/'), f[2]) for f in self.find_files()],
+            [('a.css', False), ('b.scss', False), ('c.tmTheme', True), ('sub/h.html', False)]
+        )
+
+    def test_index_files(self):
+        """Test scanning the files in worker processes and in the calling thread."""
+
+        files = [(os.path.join(self.root, f[0]), f[1], f[2]) for f in self.find_files()]
+        progress = []
+        found = project.index_files(files, 1, progress=lambda *args: progress.append(args))
+        self.assertEqual(progress, [(1, 4, False), (2, 4, False), (3, 4, False), (4, 4, False)])
+        self.assertEqual(project.index_files(files, 2), found)
+        self.assertEqual(
+            {os.path.basename(k): [convert.format_palette_color(c) for c in v] for k, v in found.items()},
+            {
+                'a.css': ['#ffffffff'],
+                'b.scss': ['#7f7f7fff', '#ff0000ff'],
+                'c.tmTheme': ['#ff000080@3'],
+                'h.html': ['#0000ffff']
+            }
+        )
+        self.assertEqual(len(project.merge_colors(found)), 5)
+        self.assertIsNone(project.index_files(files, 1, aborted=lambda: True))
+        self.assertIsNone(project.index_files(files, 2, aborted=lambda: True))
+
+    def test_worker_processes(self):
+        """Test that files are scanned in worker processes, and in the calling thread if workers can't start."""
+
+        executable = sys.executable
+        try:
+            sys.executable = os.path.join(os.path.dirname(executable), 'plugin_host')
+            self.assertEqual(project.find_python(executable), executable)
+            self.assertIsNone(project.find_python())
+        finally:
+            sys.executable = executable
+        self.assertEqual(project.find_python(), executable)
+
+        files = [(os.path.join(self.root, f[0]), f[1], f[2]) for f in self.find_files()]
+        expected = project.index_files(files, 1)
+        scan_file = project.scan_file
+        progress = []
+        log = []
+        try:
+            # Nothing can be scanned in this process.
+            project.scan_file = None
+            self.assertEqual(
+                project.index_files(
+                    files, 2, python=executable, progress=lambda *args: progress.append(args), log=log.append
+                ),
+                expected
+            )
+        finally:
+            project.scan_file = scan_file
+        self.assertEqual(sorted(progress), [(1, 4, False), (2, 4, False), (3, 4, False), (4, 4, False)])
+        self.assertEqual(log, [])
+
+        progress = []
+        self.assertEqual(
+            project.index_files(
+                files, 2, python=os.path.join(self.root, 'missing-python'),
+                progress=lambda *args: progress.append(args), log=log.append
+            ),
+            expected
+        )
+        self.assertEqual(progress, [(1, 4, True), (2, 4, True), (3, 4, True), (4, 4, True)])
+        self.assertEqual(len(log), 1)
+        self.assertIn('could not be started', log[0])
+
+    def test_worker_errors(self):
+        """Test that the errors of failed workers are logged."""
+
+        files = [(os.path.join(self.root, f[0]), f[1], f[2]) for f in self.find_files()]
+        expected = project.index_files(files, 1)
+        log = []
+        name = project.__name__
+        try:
+            # The worker can't import the module.
+            project.__name__ = 'missing_module'
+            self.assertEqual(project.index_files(files, 2, python=sys.executable, log=log.append), expected)
+        finally:
+            project.__name__ = name
+        self.assertEqual(len(log), 2)
+        self.assertIn('missing_module', log[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
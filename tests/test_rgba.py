@@ -0,0 +1,238 @@
+"""Test float fast paths in `lib.rgba`."""
+import unittest
+import decimal
+import random
+from lib import rgba, csscolors
+
+
+def decimal_round_int(dec):
+    """Reference `round_int` using `Decimal`."""
+
+    return int(decimal.Decimal(dec).quantize(decimal.Decimal('0'), decimal.ROUND_HALF_UP))
+
+
+def decimal_fmt_float(f, p=0):
+    """Reference `fmt_float` using `Decimal`."""
+
+    string = str(
+        decimal.Decimal(f).quantize(decimal.Decimal('0.' + ('0' * p) if p > 0 else '0'), decimal.ROUND_HALF_UP)
+    )
+
+    m = rgba.FLOAT_TRIM_RE.match(string)
+    if m:
+        string = m.group('keep')
+        if m.group('keep2'):
+            string += m.group('keep2')
+    return string
+
+
+def sample_values():
+    """Get floats representative of what the conversions produce plus exact and near ties."""
+
+    values = []
+    for c in range(256):
+        values.append(c / 255.0)
+        values.append(c * 100.0 / 255.0)
+        values.append(c * 360.0 / 255.0)
+        values.append(c + 0.5)
+        values.append(c + 0.05)
+        values.append(c + 0.005)
+        values.append(c + 0.25)
+        values.append(c + 0.125)
+    for i in range(0, 360000, 7):
+        values.append(i / 1000.0)
+    rand = random.Random(0)
+    for _ in range(10000):
+        values.append(rand.uniform(0, 360))
+    values.extend([0.0, -0.0, 1e-7, 2.5e-7, 0.4999999999999999, 1e15 + 0.5, 2.0 ** 52 + 1])
+    values.extend([-v for v in values])
+    return values
+
+
+class TestFloatFastPath(unittest.TestCase):
+    """Test that the float fast paths match the `Decimal` rounding exactly."""
+
+    def test_round_int(self):
+        """Test `round_int` against `Decimal`."""
+
+        for value in sample_values():
+            self.assertEqual(rgba.round_int(value), decimal_round_int(value), repr(value))
+
+    def test_round_int_int(self):
+        """Test `round_int` with integers."""
+
+        for value in (0, 1, -1, 255, 2 ** 70):
+            self.assertEqual(rgba.round_int(value), value)
+
+    def test_fmt_float(self):
+        """Test `fmt_float` against `Decimal`."""
+
+        for p in range(8):
+            for value in sample_values():
+                self.assertEqual(rgba.fmt_float(value, p), decimal_fmt_float(value, p), '%r %d' % (value, p))
+
+    def test_fmt_float_fallback(self):
+        """Test values that take the `Decimal` path."""
+
+        for value in (1e12 + 0.5, -1e12, 0.1, 2 ** 40, float('inf')):
+            for p in (0, 3, 6, 9):
+                if value == float('inf'):
+                    self.assertRaises(decimal.InvalidOperation, rgba.fmt_float, value, p)
+                else:
+                    self.assertEqual(rgba.fmt_float(value, p), decimal_fmt_float(value, p))
+
+    def test_fmt_float_negative_precision(self):
+        """Test that negative precision acts like zero precision."""
+
+        self.assertEqual(rgba.fmt_float(2.5, -1), decimal_fmt_float(2.5, -1))
+        self.assertEqual(rgba.fmt_float(2.5, -1), '3')
+
+
+class TestConversionTables(unittest.TestCase):
+    """Test that table backed conversions match `colorsys`."""
+
+    def setUp(self):
+        """Setup."""
+
+        rgba.clear_conversion_cache()
+
+    def tearDown(self):
+        """Cleanup."""
+
+        rgba.RGBA.conversion_tables = True
+
+    def convert(self, color, tables):
+        """Convert the color with or without the tables."""
+
+        rgba.RGBA.conversion_tables = tables
+        return color.tohls(), color.tohsv(), color.tohwb()
+
+    def test_conversions(self):
+        """Test conversions against `colorsys`."""
+
+        rand = random.Random(0)
+        values = [0x000000, 0xffffff, 0x808080, 0xff0000, 0x00ff00, 0x0000ff]
+        values.extend(rand.getrandbits(24) for _ in range(5000))
+        for value in values:
+            color = rgba.RGBA('#%06x' % value)
+            expected = self.convert(color, False)
+            self.assertEqual(self.convert(color, True), expected)
+            # Cached result
+            self.assertEqual(self.convert(color, True), expected)
+
+    def test_fallback(self):
+        """Test channels that cannot be packed fall back to `colorsys`."""
+
+        color = rgba.RGBA('#336699')
+        color.r = 51.5
+        self.assertIsNone(color._get_rgb24())
+        self.assertEqual(self.convert(color, True), self.convert(color, False))
+
+        rgba.RGBA.conversion_tables = True
+        color.r = 255.0
+        self.assertEqual(color._get_rgb24(), 0xff6699)
+
+
+class TestPackedColor(unittest.TestCase):
+    """Test packed integer colors."""
+
+    def test_pack_hex(self):
+        """Test packing the supported hex forms."""
+
+        self.assertEqual(rgba.pack_hex('#336699'), 0x336699ff)
+        self.assertEqual(rgba.pack_hex('#33669980'), 0x33669980)
+        self.assertEqual(rgba.pack_hex('#369'), 0x336699ff)
+        self.assertEqual(rgba.pack_hex('#3698'), 0x33669988)
+        self.assertEqual(rgba.pack_hex(b'ABCDEF'), 0xabcdefff)
+        for value in ('#12345', '#+12345', '#12 345', '#gggggg', ''):
+            self.assertRaises(ValueError, rgba.pack_hex, value)
+
+    def test_packed_color(self):
+        """Test the packed color type."""
+
+        color = rgba.PackedColor.from_hex_bytes('#33669980')
+        self.assertEqual((color.r, color.g, color.b, color.a), (0x33, 0x66, 0x99, 0x80))
+        self.assertEqual(color.to_hex(), '#33669980')
+        self.assertEqual(color.to_hex(alpha=False), '#336699')
+        self.assertEqual(rgba.PackedColor.from_int(0x33669980), color)
+        self.assertRaises(ValueError, rgba.PackedColor.from_int, 0x100000000)
+        self.assertRaises(ValueError, rgba.PackedColor.from_int, -1)
+
+    def test_rgba_round_trip(self):
+        """Test converting between `RGBA` and packed colors."""
+
+        color = rgba.RGBA('#33669980')
+        self.assertEqual(color.to_int(), 0x33669980)
+        self.assertEqual(rgba.RGBA.from_int(0x33669980).get_rgba(), color.get_rgba())
+        self.assertEqual(rgba.RGBA.from_hex_bytes('#369').get_rgba(), rgba.RGBA('#369').get_rgba())
+        self.assertEqual(rgba.PackedColor(0x33669980).to_rgba().get_rgba(), '#33669980')
+
+    def test_rgba_slots(self):
+        """Test that `RGBA` doesn't carry an instance dictionary."""
+
+        color = rgba.RGBA()
+        self.assertFalse(hasattr(color, '__dict__'))
+        with self.assertRaises(AttributeError):
+            color.x = 1
+
+
+class TestBatchConversion(unittest.TestCase):
+    """Test batch color conversions."""
+
+    def make_colors(self):
+        """Get edge case and random packed colors."""
+
+        rand = random.Random(0)
+        values = [0x000000ff, 0xffffffff, 0x80808080, 0xff0000ff, 0x00ff00ff, 0x0000ffff, 0xff00ff00, 0x010203ff]
+        values.extend(rand.getrandbits(32) for _ in range(5000))
+        return values
+
+    def test_columns(self):
+        """Test the columns against converting each color."""
+
+        values = self.make_colors()
+        columns = rgba.convert_colors(values, csscolors.hex2name_map, backend='python')
+        self.assertEqual(len(columns), len(values))
+        for i, value in enumerate(values):
+            color = rgba.RGBA('#%08x' % value)
+            h, l, s = color.tohls()
+            self.assertEqual(columns.hex[i], color.get_rgb().lower())
+            self.assertEqual(columns.alpha[i], color.a)
+            self.assertEqual(columns.rgb[i], (color.r, color.g, color.b))
+            self.assertEqual(columns.hsl[i], (h, s, l))
+            self.assertEqual(columns.hwb[i], color.tohwb())
+            self.assertEqual(columns.luminance[i], color.get_luminance())
+            self.assertEqual(columns.name[i], csscolors.hex2name(color.get_rgb()))
+
+    def test_strings(self):
+        """Test converting hex strings."""
+
+        columns = rgba.convert_colors(['#F00', '#00ff0080', '#123456'], csscolors.hex2name_map)
+        self.assertEqual(columns.packed, [0xff0000ff, 0x00ff0080, 0x123456ff])
+        self.assertEqual(columns.name, ['red', 'lime', None])
+        self.assertEqual(rgba.convert_colors(['#F00']).name, [None])
+        self.assertEqual(len(rgba.convert_colors([])), 0)
+
+    def test_selected_columns(self):
+        """Test that only the selected columns are computed."""
+
+        values = self.make_colors()[:100]
+        expected = rgba.convert_colors(values, csscolors.hex2name_map)
+        for backend in ('python', 'numpy') if rgba.numpy is not None else ('python',):
+            for columns in (('hex',), ('rgb',), ('hex', 'alpha'), ('name', 'hsl', 'hwb'), ('luminance',)):
+                found = rgba.convert_colors(values, csscolors.hex2name_map, backend=backend, columns=columns)
+                self.assertEqual(found.packed, expected.packed)
+                for name in columns:
+                    self.assertEqual(getattr(found, name), getattr(expected, name), name)
+                for name in set(('alpha', 'rgb', 'hsl', 'hwb', 'luminance')) - set(columns):
+                    self.assertIsNone(getattr(found, name), name)
+
+    @unittest.skipUnless(rgba.numpy is not None, 'NumPy is not installed')
+    def test_numpy(self):
+        """Test that the NumPy backend gives the same results as the pure Python one."""
+
+        values = self.make_colors()
+        expected = rgba.convert_colors(values, csscolors.hex2name_map, backend='python')
+        columns = rgba.convert_colors(values, csscolors.hex2name_map, backend='numpy')
+        for name in ('packed', 'hex', 'alpha', 'rgb', 'hsl', 'hwb', 'luminance', 'name'):
+            self.assertEqual(getattr(columns, name), getattr(expected, name), name)